@@ -0,0 +1,366 @@
+"""
+Benchmark the office converter Lambdas on a synthetic corpus.
+
+Runs the handlers of data-pipeline/main.py and data-preprocessing/lambda/ppt_processor/main.py
+locally on every document of a corpus (see synthetic_corpus.py), with S3 replaced by a local
+directory. Each configuration (entry point x converter mode x native extraction x splitting x
+soffice flags) runs in its own worker process, so the settings read at import time apply and the
+memory figures of one configuration do not leak into the next. For every document it reports:
+
+    latency     percentiles of the handler call over --repeat runs
+    peak RSS    of the worker and all its child processes (soffice, unoserver), sampled from /proc
+    peak /tmp   growth of the used space of the /tmp file system during the call
+
+Results are written as JSON; pass an earlier result file with --baseline to print the change of
+the median latency per document.
+
+Usage:
+    python conversion_benchmark.py <corpus_folder> [--generate] [--entry-points data-pipeline ppt_processor]
+                                   [--modes oneshot warm] [--native true false] [--split false]
+                                   [--soffice-flags "--headless --nologo"] [--repeat 3]
+                                   [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import hashlib
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.parse
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_PIPELINE_DIR = os.path.join(BENCHMARK_DIR, '..')
+ENTRY_POINTS = {
+    'data-pipeline': os.path.join(DATA_PIPELINE_DIR, 'main.py'),
+    'ppt_processor': os.path.join(DATA_PIPELINE_DIR, '..', 'data-preprocessing', 'lambda', 'ppt_processor', 'main.py'),
+}
+DOCUMENT_EXTENSIONS = ('.docx', '.pptx', '.xlsx', '.csv', '.doc', '.ppt', '.xls')
+INPUT_BUCKET = 'benchmark-input'
+OUTPUT_BUCKET = 'benchmark-output'
+MB = 1024 * 1024
+
+# Subsets of s3transfer's ALLOWED_DOWNLOAD_ARGS / ALLOWED_UPLOAD_ARGS the converters may use
+ALLOWED_DOWNLOAD_ARGS = ['ChecksumMode', 'VersionId', 'SSECustomerAlgorithm', 'SSECustomerKey', 'SSECustomerKeyMD5', 'RequestPayer', 'ExpectedBucketOwner']
+ALLOWED_UPLOAD_ARGS = ['ACL', 'CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'ContentType', 'Expires', 'Metadata', 'ServerSideEncryption', 'StorageClass', 'SSEKMSKeyId', 'Tagging', 'ExpectedBucketOwner']
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "mean_ms": statistics.mean(values) if values else None,
+        "min_ms": min(values) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p90_ms": percentile(values, 90),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": max(values) if values else None,
+    }
+
+
+# S3 stand-in backed by a local directory, installed as the s3_transfer module the converters use
+class LocalS3:
+    def __init__(self, root):
+        self.root = root
+        self.metadata = {}
+        self.etags = {}
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def etag(self, path):
+        stat = os.stat(path)
+        cached = self.etags.get(path)
+        if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+            digest = hashlib.md5()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(MB), b''):
+                    digest.update(block)
+            cached = ((stat.st_mtime_ns, stat.st_size), digest.hexdigest())
+            self.etags[path] = cached
+        return cached[1]
+
+    # Reject what s3transfer would reject, so the stand-in cannot hide an invalid argument
+    @staticmethod
+    def check_extra_args(extra_args, allowed):
+        for name in extra_args or {}:
+            if name not in allowed:
+                raise ValueError(f"Invalid extra_args key '{name}', must be one of: {', '.join(allowed)}")
+
+    def head_object(self, bucket, key):
+        path = self.path(bucket, key)
+        if not os.path.exists(path):
+            return None
+        return {'ETag': f'"{self.etag(path)}"', 'Metadata': self.metadata.get((bucket, key), {})}
+
+    def download_file(self, bucket, key, local_file, extra_args=None):
+        self.check_extra_args(extra_args, ALLOWED_DOWNLOAD_ARGS)
+        shutil.copyfile(self.path(bucket, key), local_file)
+        return local_file
+
+    def upload_file(self, local_file, bucket, key, extra_args=None):
+        self.check_extra_args(extra_args, ALLOWED_UPLOAD_ARGS)
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(local_file, path)
+        self.metadata[(bucket, key)] = (extra_args or {}).get('Metadata', {})
+        return key
+
+    def delete_objects(self, bucket, keys):
+        for key in keys:
+            if os.path.exists(self.path(bucket, key)):
+                os.remove(self.path(bucket, key))
+            self.metadata.pop((bucket, key), None)
+
+    def module(self):
+        module = types.ModuleType('s3_transfer')
+        for name in ('head_object', 'download_file', 'upload_file', 'delete_objects'):
+            setattr(module, name, getattr(self, name))
+        return module
+
+
+# Resident memory of a process and all its descendants, from /proc (Linux only)
+def process_tree_rss(pid):
+    children = {}
+    rss = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_size
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total
+
+
+# Samples the peak RSS of the process tree and the peak growth of the used /tmp space while running
+class ResourceSampler(threading.Thread):
+    def __init__(self, tmp_dir, interval=0.05):
+        super().__init__(daemon=True)
+        self.tmp_dir = tmp_dir
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.baseline_tmp = shutil.disk_usage(tmp_dir).used
+        self.peak_rss = 0
+        self.peak_tmp = 0
+
+    def sample(self):
+        if sys.platform.startswith('linux'):
+            self.peak_rss = max(self.peak_rss, process_tree_rss(os.getpid()))
+        self.peak_tmp = max(self.peak_tmp, shutil.disk_usage(self.tmp_dir).used - self.baseline_tmp)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def s3_event(bucket, key):
+    return {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': urllib.parse.quote_plus(key)}}}]}
+
+
+def load_entry_point(name):
+    spec = importlib.util.spec_from_file_location(f"{name.replace('-', '_')}_main", ENTRY_POINTS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Benchmark one configuration in this process; called in a worker started by run_configuration
+def run_worker(config):
+    os.environ.update({
+        'CONVERTER_MODE': config['mode'],
+        'NATIVE_EXTRACTION': str(config['native']).lower(),
+        'SPLIT_PARTS': str(config['split']).lower(),
+        'SKIP_UNCHANGED': 'false',
+        'OUTPUT_BUCKET': OUTPUT_BUCKET,
+        'OUTPUT_BUCKET_NAME': OUTPUT_BUCKET,
+    })
+    sys.path.insert(0, DATA_PIPELINE_DIR)
+    s3 = LocalS3(config['s3_root'])
+    sys.modules['s3_transfer'] = s3.module()
+    import office_converter
+    if config['soffice_flags'] is not None:
+        office_converter.SOFFICE_FLAGS = config['soffice_flags'].split()
+    entry_point = load_entry_point(config['entry_point'])
+
+    documents = {}
+    try:
+        for file in config['documents']:
+            latencies, peak_rss, peak_tmp, statuses, errors, outputs = [], 0, 0, [], [], 0
+            for _ in range(config['repeat']):
+                sampler = ResourceSampler(config['tmp_dir'])
+                sampler.start()
+                start = time.perf_counter()
+                try:
+                    result = entry_point.handler(s3_event(INPUT_BUCKET, file), None)['results'][0]
+                except Exception as e:
+                    # The handlers raise when an object of a direct S3 event fails
+                    result = {'status': 'failed', 'error': str(e)}
+                latencies.append((time.perf_counter() - start) * 1000)
+                sampler.stop()
+                peak_rss = max(peak_rss, sampler.peak_rss)
+                peak_tmp = max(peak_tmp, sampler.peak_tmp)
+                statuses.append(result['status'])
+                if result['status'] == 'failed':
+                    errors.append(result.get('error'))
+                outputs = result.get('chunks') or result.get('parts') or (1 if result['status'] == 'converted' else 0)
+            documents[file] = {
+                "latency": latency_summary(latencies),
+                # The first run of a warm configuration includes the LibreOffice start
+                "first_run_ms": latencies[0],
+                "peak_rss_mb": peak_rss / MB,
+                "peak_tmp_mb": peak_tmp / MB,
+                "statuses": statuses,
+                "errors": errors,
+                "outputs": outputs,
+            }
+    finally:
+        if office_converter._warm_instance is not None:
+            office_converter._warm_instance.stop()
+
+    with open(config['result_file'], 'w') as f:
+        json.dump(documents, f)
+
+
+def run_configuration(config, verbose):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        config = {**config, 'result_file': f.name}
+    try:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config)],
+            check=True, stdout=None if verbose else subprocess.DEVNULL,
+        )
+        with open(config['result_file']) as f:
+            return json.load(f)
+    finally:
+        os.remove(config['result_file'])
+
+
+def configurations(args):
+    for entry_point, mode, native, split, flags in itertools.product(args.entry_points, args.modes, args.native, args.split, args.soffice_flags or [None]):
+        # ppt_processor always converts to PDF
+        if entry_point == 'ppt_processor' and native:
+            continue
+        name = f"{entry_point}/{mode}/native={str(native).lower()}/split={str(split).lower()}"
+        if flags is not None:
+            name += f"/flags={flags}"
+        yield {'name': name, 'entry_point': entry_point, 'mode': mode, 'native': native, 'split': split, 'soffice_flags': flags}
+
+
+def compare(results, baseline):
+    previous = {configuration['name']: configuration for configuration in baseline.get('configurations', [])}
+    for configuration in results['configurations']:
+        before = previous.get(configuration['name'])
+        if before is None:
+            continue
+        for file, document in configuration['documents'].items():
+            old = before['documents'].get(file)
+            if old and old['latency']['p50_ms'] and document['latency']['p50_ms']:
+                change = document['latency']['p50_ms'] / old['latency']['p50_ms'] - 1
+                print(f"{configuration['name']} {file}: p50 {old['latency']['p50_ms']:.0f} -> {document['latency']['p50_ms']:.0f} ms ({change:+.0%})")
+
+
+def parse_bool(value):
+    return value.lower() in ('true', '1', 'yes', 'on')
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--worker':
+        run_worker(json.loads(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the office converter Lambdas on a synthetic corpus.")
+    parser.add_argument("corpus_folder", help="Folder with the documents (see synthetic_corpus.py)")
+    parser.add_argument("--generate", action="store_true", help="Generate the default synthetic corpus into the folder first")
+    parser.add_argument("--entry-points", nargs="+", choices=sorted(ENTRY_POINTS), default=sorted(ENTRY_POINTS))
+    parser.add_argument("--modes", nargs="+", choices=["oneshot", "warm"], default=["oneshot", "warm"])
+    parser.add_argument("--native", nargs="+", type=parse_bool, default=[True, False], help="Native extraction settings (data-pipeline)")
+    parser.add_argument("--split", nargs="+", type=parse_bool, default=[False], help="SPLIT_PARTS settings")
+    parser.add_argument("--soffice-flags", action="append", help="soffice flag set to compare (repeatable), default: the converter's")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per document and configuration")
+    parser.add_argument("--tmp-dir", default="/tmp", help="File system whose usage is sampled")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Earlier result file to compare the median latencies with")
+    parser.add_argument("--verbose", action="store_true", help="Show the converters' output")
+    args = parser.parse_args()
+
+    if args.generate:
+        from synthetic_corpus import generate_corpus
+        generate_corpus(args.corpus_folder)
+    documents = sorted(file for file in os.listdir(args.corpus_folder) if file.lower().endswith(DOCUMENT_EXTENSIONS))
+
+    results = {
+        "environment": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "corpus": {file: os.path.getsize(os.path.join(args.corpus_folder, file)) for file in documents},
+        "configurations": [],
+    }
+    with tempfile.TemporaryDirectory(prefix='conversion-benchmark-') as s3_root:
+        # The input bucket of the local S3 is the corpus itself
+        os.makedirs(os.path.join(s3_root, INPUT_BUCKET), exist_ok=True)
+        for file in documents:
+            os.symlink(os.path.abspath(os.path.join(args.corpus_folder, file)), os.path.join(s3_root, INPUT_BUCKET, file))
+
+        for configuration in configurations(args):
+            print(f"Benchmarking {configuration['name']}")
+            config = {**configuration, 's3_root': s3_root, 'documents': documents, 'repeat': args.repeat, 'tmp_dir': args.tmp_dir}
+            configuration['documents'] = run_configuration(config, args.verbose)
+            results["configurations"].append(configuration)
+            shutil.rmtree(os.path.join(s3_root, OUTPUT_BUCKET), ignore_errors=True)
+
+    print(json.dumps(results, indent=4))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.output}")
+
+    # Timings of runs that converted nothing are meaningless: fail the benchmark
+    failures = [
+        (configuration['name'], file, document['errors'])
+        for configuration in results['configurations'] for file, document in configuration['documents'].items() if document['errors']
+    ]
+    for name, file, errors in failures:
+        print(f"FAILED {name} {file}: {errors[0]}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
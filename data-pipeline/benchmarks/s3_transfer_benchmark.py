@@ -0,0 +1,158 @@
+"""
+Benchmark the S3 transfer paths of the office converter Lambdas.
+
+Uploads an object of each size to a bucket, then times three ways of moving it:
+
+    default   a fresh boto3.client('s3') per call with the default transfer settings,
+              as the converters did before s3_transfer.py
+    tuned     the shared s3_transfer client and TransferConfig (parallel ranged GETs /
+              multipart uploads over a warm connection pool)
+    stream    s3_transfer.download_fileobj / upload_fileobj against an in-memory buffer,
+              skipping the local file
+
+Point it at real S3 or at a local stand-in (MinIO, moto_server, localstack) with
+--endpoint-url; without an endpoint and with moto installed it starts a moto server itself.
+
+Usage:
+    python s3_transfer_benchmark.py [--bucket NAME] [--endpoint-url URL]
+                                    [--sizes-mb 1 50 500] [--repeat 3] [--output results.json]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def timing_summary(values, size_bytes):
+    mean = statistics.mean(values)
+    return {
+        "count": len(values),
+        "mean_ms": mean * 1000,
+        "p50_ms": percentile(values, 50) * 1000,
+        "max_ms": max(values) * 1000,
+        "throughput_mb_s": size_bytes / (1024 * 1024) / mean if mean else None,
+    }
+
+
+def timed(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# Start a local moto S3 server when no endpoint was given; returns (endpoint_url, server)
+def local_endpoint():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit("No --endpoint-url given and moto is not installed (pip install 'moto[server]')")
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    return f"http://{host}:{port}", server
+
+
+def benchmark_size(size_mb, bucket, endpoint_url, repeat, workdir):
+    import boto3
+    import s3_transfer
+
+    size_bytes = size_mb * 1024 * 1024
+    source = os.path.join(workdir, f"source-{size_mb}mb.bin")
+    target = os.path.join(workdir, f"target-{size_mb}mb.bin")
+    with open(source, "wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    key = f"benchmark/{size_mb}mb.bin"
+    s3_transfer.upload_file(source, bucket, key)
+
+    def default_client():
+        return boto3.client("s3", endpoint_url=endpoint_url)
+
+    def stream_download():
+        buffer = io.BytesIO()
+        s3_transfer.download_fileobj(bucket, key, buffer)
+
+    def stream_upload():
+        with open(source, "rb") as f:
+            s3_transfer.upload_fileobj(io.BytesIO(f.read()), bucket, f"{key}.stream")
+
+    results = {
+        "download": {
+            "default": timed(lambda: default_client().download_file(bucket, key, target), repeat),
+            "tuned": timed(lambda: s3_transfer.download_file(bucket, key, target), repeat),
+            "stream": timed(stream_download, repeat),
+        },
+        "upload": {
+            "default": timed(lambda: default_client().upload_file(source, bucket, f"{key}.default"), repeat),
+            "tuned": timed(lambda: s3_transfer.upload_file(source, bucket, f"{key}.tuned"), repeat),
+            "stream": timed(stream_upload, repeat),
+        },
+    }
+    os.remove(source)
+    if os.path.exists(target):
+        os.remove(target)
+    return {
+        direction: {path: timing_summary(durations, size_bytes) for path, durations in paths.items()}
+        for direction, paths in results.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the S3 transfer paths of the office converters.")
+    parser.add_argument("--bucket", default="s3-transfer-benchmark", help="Bucket to use, created if missing")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local MinIO or moto_server")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 50, 500], help="Object sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per path and direction")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        endpoint_url, server = local_endpoint()
+    # s3_transfer builds its client at import time from these
+    os.environ["S3_ENDPOINT_URL"] = endpoint_url
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+    import s3_transfer
+    try:
+        s3_transfer.s3_client.head_bucket(Bucket=args.bucket)
+    except Exception:
+        s3_transfer.s3_client.create_bucket(Bucket=args.bucket)
+
+    results = {"endpoint_url": endpoint_url, "repeat": args.repeat, "sizes": {}}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size_mb in args.sizes_mb:
+                print(f"Benchmarking {size_mb} MB")
+                results["sizes"][f"{size_mb}MB"] = benchmark_size(size_mb, args.bucket, endpoint_url, args.repeat, workdir)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Generate a synthetic corpus of office documents for the conversion benchmark.
+
+Every document is built from seeded random text, so the same arguments always produce the same
+corpus. Sizes are controlled per format:
+
+    docx    paragraphs (with a heading every 10 paragraphs and a table every 50)
+    pptx    slides (title, bullets and a small table on every 5th slide)
+    xlsx    sheets x rows x columns (written with a write-only openpyxl workbook)
+    csv     rows x columns
+
+Usage:
+    python synthetic_corpus.py <output_folder> [--docx-paragraphs 10 200 2000] [--pptx-slides 5 50 200]
+                               [--xlsx-sheets 1 10 40] [--xlsx-rows 1000] [--csv-rows 1000 50000 500000]
+                               [--columns 8] [--seed 7]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+
+import docx
+import openpyxl
+import pptx
+from pptx.util import Inches
+
+WORDS = (
+    "revenue forecast quarter region customer pipeline margin growth segment product launch "
+    "operating cost headcount market share retention churn contract renewal partner channel "
+    "inventory supply demand pricing discount target variance budget actual plan review"
+).split()
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng, sentences=4):
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def row_values(rng, index, columns):
+    return [index, rng.choice(WORDS), *(round(rng.uniform(0, 10000), 2) for _ in range(columns - 2))]
+
+
+def generate_docx(path, paragraphs, rng):
+    document = docx.Document()
+    document.add_heading(f"Synthetic report ({paragraphs} paragraphs)", 0)
+    for index in range(paragraphs):
+        if index % 10 == 0:
+            document.add_heading(sentence(rng, 4), 1)
+        document.add_paragraph(paragraph(rng))
+        if index % 50 == 49:
+            table = document.add_table(rows=6, cols=4)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = rng.choice(WORDS)
+    document.save(path)
+
+
+def generate_pptx(path, slides, rng):
+    presentation = pptx.Presentation()
+    for index in range(slides):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = f"Slide {index + 1}: {sentence(rng, 4)}"
+        body = slide.placeholders[1].text_frame
+        body.text = sentence(rng)
+        for _ in range(4):
+            body.add_paragraph().text = sentence(rng, 8)
+        if index % 5 == 4:
+            table = slide.shapes.add_table(4, 4, Inches(1), Inches(5), Inches(8), Inches(1.5)).table
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = rng.choice(WORDS)
+    presentation.save(path)
+
+
+def generate_xlsx(path, sheets, rows, columns, rng):
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_index in range(sheets):
+        sheet = workbook.create_sheet(f"Sheet{sheet_index + 1}")
+        sheet.append(["id", "label", *(f"value_{column}" for column in range(columns - 2))])
+        for index in range(rows):
+            sheet.append(row_values(rng, index, columns))
+    workbook.save(path)
+
+
+def generate_csv(path, rows, columns, rng):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "label", *(f"value_{column}" for column in range(columns - 2))])
+        for index in range(rows):
+            writer.writerow(row_values(rng, index, columns))
+
+
+# Write the corpus into folder and return its description: one entry per file with the format, the
+# size parameters and the file size
+def generate_corpus(folder, docx_paragraphs=(10, 200, 2000), pptx_slides=(5, 50, 200), xlsx_sheets=(1, 10, 40),
+                    xlsx_rows=1000, csv_rows=(1000, 50000, 500000), columns=8, seed=7):
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    documents = []
+
+    def add(name, generate, **parameters):
+        path = os.path.join(folder, name)
+        print(f"Generating {path}")
+        generate(path, **parameters, rng=rng)
+        documents.append({"file": name, "format": os.path.splitext(name)[1][1:], **parameters, "bytes": os.path.getsize(path)})
+
+    for paragraphs in docx_paragraphs:
+        add(f"report-{paragraphs}p.docx", generate_docx, paragraphs=paragraphs)
+    for slides in pptx_slides:
+        add(f"deck-{slides}s.pptx", generate_pptx, slides=slides)
+    for sheets in xlsx_sheets:
+        add(f"workbook-{sheets}x{xlsx_rows}.xlsx", generate_xlsx, sheets=sheets, rows=xlsx_rows, columns=columns)
+    for rows in csv_rows:
+        add(f"table-{rows}r.csv", generate_csv, rows=rows, columns=columns)
+
+    with open(os.path.join(folder, "corpus.json"), "w") as f:
+        json.dump({"seed": seed, "documents": documents}, f, indent=4)
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic office document corpus.")
+    parser.add_argument("output_folder", help="Folder to write the documents to")
+    parser.add_argument("--docx-paragraphs", type=int, nargs="+", default=[10, 200, 2000])
+    parser.add_argument("--pptx-slides", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--xlsx-sheets", type=int, nargs="+", default=[1, 10, 40])
+    parser.add_argument("--xlsx-rows", type=int, default=1000, help="Rows per sheet")
+    parser.add_argument("--csv-rows", type=int, nargs="+", default=[1000, 50000, 500000])
+    parser.add_argument("--columns", type=int, default=8, help="Columns of the xlsx and csv tables")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    generate_corpus(
+        args.output_folder, args.docx_paragraphs, args.pptx_slides, args.xlsx_sheets,
+        args.xlsx_rows, args.csv_rows, args.columns, args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
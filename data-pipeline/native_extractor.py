@@ -0,0 +1,223 @@
+import csv
+import datetime
+import os
+
+import docx
+import openpyxl
+import pptx
+from docx.table import Table
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+# Direct text extraction for office formats whose content is text and tables. DOCX is read with
+# python-docx, XLSX with a read-only (streaming) openpyxl workbook, CSV with the csv module and
+# PPTX text frames with python-pptx. The document is turned into markdown blocks (headings,
+# paragraphs, tables) that are packed into chunk files for the knowledge base, without the
+# LibreOffice -> PDF -> vision model round trip. Documents whose meaning depends on their visual
+# layout (pictures, charts) are left to that path, see layout_reason.
+
+# Extensions handled natively, set through NATIVE_EXTENSIONS (comma separated)
+NATIVE_EXTENSIONS = [extension.strip().lower() for extension in os.getenv('NATIVE_EXTENSIONS', '.docx,.xlsx,.csv,.pptx').split(',') if extension.strip()]
+
+# Upper bound of the characters of one chunk file
+CHUNK_CHARACTERS = int(os.getenv('CHUNK_CHARACTERS', '8000'))
+
+# Slides where pictures cover more than this share of the slide area go through the vision path
+MAX_PICTURE_RATIO = float(os.getenv('MAX_PICTURE_RATIO', '0.2'))
+
+# Bytes read to guess the CSV dialect
+CSV_SNIFF_BYTES = 64 * 1024
+
+
+def can_extract(file):
+    return os.path.splitext(file)[1].lower() in NATIVE_EXTENSIONS
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        value = value.isoformat()
+    return str(value).replace('\r', ' ').replace('\n', ' ').replace('|', '\\|').strip()
+
+
+def markdown_table(rows):
+    width = max(len(row) for row in rows)
+    rows = [list(row) + [''] * (width - len(row)) for row in rows]
+    lines = ['| ' + ' | '.join(rows[0]) + ' |', '|' + ' --- |' * width]
+    lines.extend('| ' + ' | '.join(row) + ' |' for row in rows[1:])
+    return '\n'.join(lines)
+
+
+# Markdown blocks of a (possibly very long) table: rows are grouped so that each block stays below
+# max_characters, and every block repeats the title and the header row, so each chunk can be read
+# on its own. Rows are consumed lazily; trailing empty cells and empty rows are dropped.
+def table_blocks(title, rows, max_characters=CHUNK_CHARACTERS):
+    header, block, size, part = None, [], 0, 0
+    for row in rows:
+        row = [cell_text(value) for value in row]
+        while row and not row[-1]:
+            row.pop()
+        if not row:
+            continue
+        if header is None:
+            header = row
+            continue
+        row_size = sum(len(cell) + 3 for cell in row) + 2
+        if block and size + row_size > max_characters:
+            yield table_block(title, header, block, part)
+            block, size, part = [], 0, part + 1
+        block.append(row)
+        size += row_size
+    if header is not None:
+        yield table_block(title, header, block, part)
+
+
+def table_block(title, header, rows, part):
+    heading = f"## {title}" if part == 0 else f"## {title} (continued)"
+    return f"{heading}\n\n{markdown_table([header] + rows)}"
+
+
+def docx_blocks(file):
+    document = docx.Document(file)
+    for item in document.iter_inner_content():
+        if isinstance(item, Table):
+            rows = [[cell_text(cell.text) for cell in row.cells] for row in item.rows]
+            if rows:
+                yield markdown_table(rows)
+            continue
+        text = item.text.strip()
+        if not text:
+            continue
+        style = item.style.name if item.style is not None else ''
+        if style == 'Title':
+            yield f"# {text}"
+        elif style.startswith('Heading') and style[len('Heading'):].strip().isdigit():
+            yield f"{'#' * min(int(style[len('Heading'):]) + 1, 6)} {text}"
+        elif style.startswith('List Number'):
+            yield f"1. {text}"
+        elif style.startswith('List'):
+            yield f"- {text}"
+        else:
+            yield text
+
+
+def xlsx_blocks(file):
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield from table_blocks(f"Sheet: {sheet.title}", sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def csv_blocks(file):
+    with open(file, newline='', encoding='utf-8-sig', errors='replace') as f:
+        sample = f.read(CSV_SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample)
+        except csv.Error:
+            dialect = csv.excel
+        yield from table_blocks(os.path.basename(file), csv.reader(f, dialect))
+
+
+# Shapes of a slide in reading order (top to bottom, left to right), with group shapes expanded
+def slide_shapes(shapes):
+    ordered = sorted(shapes, key=lambda shape: (shape.top or 0, shape.left or 0))
+    for shape in ordered:
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            yield from slide_shapes(shape.shapes)
+        else:
+            yield shape
+
+
+def pptx_blocks(file):
+    presentation = pptx.Presentation(file)
+    for number, slide in enumerate(presentation.slides, start=1):
+        title = slide.shapes.title.text.strip() if slide.shapes.title is not None and slide.shapes.title.has_text_frame else ''
+        lines = [f"## Slide {number}: {title}" if title else f"## Slide {number}"]
+        for shape in slide_shapes(slide.shapes):
+            if shape == slide.shapes.title:
+                continue
+            if shape.has_text_frame:
+                for paragraph in shape.text_frame.paragraphs:
+                    text = ''.join(run.text for run in paragraph.runs).strip()
+                    if text:
+                        lines.append(f"{'  ' * paragraph.level}- {text}")
+            elif getattr(shape, 'has_table', False) and shape.has_table:
+                rows = [[cell_text(cell.text) for cell in row.cells] for row in shape.table.rows]
+                if rows:
+                    lines.append('')
+                    lines.append(markdown_table(rows))
+                    lines.append('')
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame.text.strip() if slide.notes_slide.notes_text_frame else ''
+            if notes:
+                lines.append(f"\nNotes: {notes}")
+        yield '\n'.join(lines).strip()
+
+
+BLOCK_READERS = {
+    '.docx': docx_blocks,
+    '.xlsx': xlsx_blocks,
+    '.csv': csv_blocks,
+    '.pptx': pptx_blocks,
+}
+
+
+# Why a document has to go through LibreOffice and the vision model instead, or None when its
+# text can be extracted directly: DOCX with embedded drawings (pictures, charts, diagrams), PPTX
+# with charts or slides mostly covered by pictures. Spreadsheets and CSV are always extracted.
+def layout_reason(file):
+    extension = os.path.splitext(file)[1].lower()
+    if extension == '.docx':
+        body = docx.Document(file).element.body
+        if body.xpath('.//w:drawing | .//w:pict'):
+            return 'drawings'
+    elif extension == '.pptx':
+        presentation = pptx.Presentation(file)
+        slide_area = (presentation.slide_width or 1) * (presentation.slide_height or 1)
+        for slide in presentation.slides:
+            picture_area = 0
+            for shape in slide_shapes(slide.shapes):
+                if getattr(shape, 'has_chart', False) and shape.has_chart:
+                    return 'charts'
+                if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
+                    picture_area += (shape.width or 0) * (shape.height or 0)
+            if picture_area / slide_area > MAX_PICTURE_RATIO:
+                return 'pictures'
+    return None
+
+
+# Pack markdown blocks into chunks of at most max_characters (a single larger block becomes its
+# own chunk); every chunk starts with the document title
+def chunk_blocks(blocks, title, max_characters=CHUNK_CHARACTERS):
+    heading = f"# {title}\n\n"
+    chunk, size, chunks = [], len(heading), 0
+    for block in blocks:
+        if chunk and size + len(block) + 2 > max_characters:
+            yield heading + '\n\n'.join(chunk) + '\n'
+            chunk, size, chunks = [], len(heading), chunks + 1
+        chunk.append(block)
+        size += len(block) + 2
+    # An empty document still gets one chunk, so it has an output to compare against
+    if chunk or not chunks:
+        yield heading + '\n\n'.join(chunk) + '\n'
+
+
+# Extract a document into markdown chunk files chunk-0001.md, chunk-0002.md, ... in outdir and
+# return their paths in order
+def extract_markdown(file, outdir, max_characters=CHUNK_CHARACTERS):
+    print(f"Extracting text from {file}...")
+    os.makedirs(outdir, exist_ok=True)
+    blocks = BLOCK_READERS[os.path.splitext(file)[1].lower()](file)
+    chunk_files = []
+    for index, chunk in enumerate(chunk_blocks(blocks, os.path.basename(file), max_characters), start=1):
+        chunk_file = os.path.join(outdir, f"chunk-{index:04d}.md")
+        with open(chunk_file, 'w', encoding='utf-8') as f:
+            f.write(chunk)
+        chunk_files.append(chunk_file)
+    print(f"Extracted {len(chunk_files)} markdown chunks from {file}.")
+    return chunk_files
@@ -0,0 +1,602 @@
+import json
+import os
+import posixpath
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+import urllib.parse
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import s3_transfer
+
+# LibreOffice conversion shared by the office converter Lambdas. Files are converted either by a
+# warm LibreOffice instance that stays up across invocations of the same execution environment
+# (driven through unoserver), or by a one-shot `soffice --convert-to` process per call. The warm
+# instance is health checked before every conversion and restarted when it stops answering; if
+# it cannot convert a file the one-shot process is used instead.
+#
+# Both converter Lambdas (data-pipeline and ppt_processor) go through convert_records: the export
+# filter comes from one table per extension, outputs are written under a key derived from the
+# source key, and an object whose output was already converted from the same ETag is not
+# converted again. data-pipeline also extracts the text of DOCX / XLSX / CSV / PPTX directly
+# into markdown chunks (native_extractor.py) and keeps LibreOffice for layouts that need it.
+
+SOFFICE = os.getenv('SOFFICE_PATH', '/opt/libreoffice7.5/program/soffice')
+SOFFICE_FLAGS = ['--headless', '--nologo', '--nodefault', '--nofirststartwizard']
+
+# warm (default) or oneshot
+CONVERTER_MODE = os.getenv('CONVERTER_MODE', 'warm').lower()
+
+# unoserver runs under the Python bundled with LibreOffice (it needs the uno module); the package
+# itself is installed into UNOSERVER_PATH and put on that interpreter's PYTHONPATH
+UNOSERVER_PYTHON = os.getenv('UNOSERVER_PYTHON', '/opt/libreoffice7.5/program/python')
+UNOSERVER_PATH = os.getenv('UNOSERVER_PATH', '/opt/unoserver')
+UNOSERVER_PORT = int(os.getenv('UNOSERVER_PORT', '2003'))
+UNO_PORT = int(os.getenv('UNO_PORT', '2002'))
+UNOSERVER_PROFILE = os.getenv('UNOSERVER_PROFILE', '/tmp/unoserver-profile')
+
+STARTUP_TIMEOUT = float(os.getenv('UNOSERVER_STARTUP_TIMEOUT', '60'))
+HEALTH_CHECK_TIMEOUT = 5
+CONVERSION_TIMEOUT = float(os.getenv('CONVERSION_TIMEOUT', '240'))
+
+# Concurrent S3 downloads / uploads when converting the records of a batched event
+MAX_TRANSFER_WORKERS = int(os.getenv('MAX_TRANSFER_WORKERS', '8'))
+
+# After a failed start the warm instance is not tried again for this long
+RESTART_BACKOFF = 300
+
+# Skip objects whose output records the same source ETag and filter (set to false to reconvert)
+SKIP_UNCHANGED = os.getenv('SKIP_UNCHANGED', 'true').lower() == 'true'
+
+# Sheets are exported one page each instead of being cut into printer pages
+SINGLE_PAGE_SHEETS = 'pdf:calc_pdf_Export:{"SinglePageSheets":{"type":"boolean","value":"true"}}'
+
+# LibreOffice --convert-to argument per source extension; anything else uses DEFAULT_FILTER
+CONVERSION_FILTERS = {
+    '.xls': SINGLE_PAGE_SHEETS,
+    '.xlsx': SINGLE_PAGE_SHEETS,
+    '.excel': SINGLE_PAGE_SHEETS,
+    '.csv': SINGLE_PAGE_SHEETS,
+    '.ods': SINGLE_PAGE_SHEETS,
+    '.doc': 'pdf:writer_pdf_Export',
+    '.docx': 'pdf:writer_pdf_Export',
+    '.odt': 'pdf:writer_pdf_Export',
+    '.rtf': 'pdf:writer_pdf_Export',
+    '.html': 'pdf:writer_web_pdf_Export',
+    '.ppt': 'pdf:impress_pdf_Export',
+    '.pptx': 'pdf:impress_pdf_Export',
+    '.odp': 'pdf:impress_pdf_Export',
+}
+DEFAULT_FILTER = 'pdf'
+
+# Emit presentations and workbooks as one PDF per slide / sheet under converted/<doc>/part-NNNN.pdf
+# with a manifest.json recording their order, so downstream consumers can process the parts in
+# parallel. Each part is an independent document to the PDF processor (its text lands next to it as
+# part-NNNN.pdf.txt); the <doc>/ prefix and the manifest, also named in every part's metadata, are
+# what ties the results back to the source. Works on the filters below, which produce one PDF page
+# per slide or sheet.
+SPLIT_PARTS = os.getenv('SPLIT_PARTS', 'false').lower() == 'true'
+SPLIT_FILTERS = [SINGLE_PAGE_SHEETS, 'pdf:impress_pdf_Export']
+
+
+# XML-RPC transport with a socket timeout, so a hung LibreOffice cannot block the Lambda
+class TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+# Split a soffice --convert-to argument such as
+#   pdf:calc_pdf_Export:{"SinglePageSheets":{"type":"boolean","value":"true"}}
+# into (extension, filter name, ["Name=value", ...]) as unoserver expects them
+def parse_convert_to(convert_to):
+    parts = convert_to.split(':', 2)
+    extension = parts[0]
+    filter_name = parts[1] if len(parts) > 1 and parts[1] else None
+    filter_options = []
+    if len(parts) > 2 and parts[2]:
+        for name, option in json.loads(parts[2]).items():
+            filter_options.append(f"{name}={option['value'] if isinstance(option, dict) else option}")
+    return extension, filter_name, filter_options
+
+
+# LibreOffice --convert-to argument for a file (or S3 key), picked by extension
+def conversion_filter(file):
+    return CONVERSION_FILTERS.get(os.path.splitext(file)[1].lower(), DEFAULT_FILTER)
+
+
+def output_path(file, convert_to, outdir):
+    return os.path.join(outdir, os.path.splitext(os.path.basename(file))[0] + '.' + convert_to.split(':')[0])
+
+
+# A LibreOffice instance kept running behind an unoserver XML-RPC listener
+class WarmLibreOffice:
+    def __init__(self, port=UNOSERVER_PORT, uno_port=UNO_PORT, profile=UNOSERVER_PROFILE):
+        self.port = port
+        self.uno_port = uno_port
+        self.profile = profile
+        self.process = None
+        self.retry_after = 0
+
+    def proxy(self, timeout):
+        return xmlrpc.client.ServerProxy(f"http://127.0.0.1:{self.port}", transport=TimeoutTransport(timeout), allow_none=True)
+
+    def healthy(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.proxy(HEALTH_CHECK_TIMEOUT).info()
+            return True
+        except (OSError, xmlrpc.client.Error):
+            return False
+
+    def start(self):
+        print("Starting warm LibreOffice instance...")
+        started = time.monotonic()
+        env = dict(os.environ, HOME='/tmp', PYTHONPATH=UNOSERVER_PATH)
+        self.process = subprocess.Popen([
+            UNOSERVER_PYTHON, '-m', 'unoserver.server',
+            '--executable', SOFFICE,
+            '--interface', '127.0.0.1', '--port', str(self.port),
+            '--uno-interface', '127.0.0.1', '--uno-port', str(self.uno_port),
+            '--user-installation', f"file://{self.profile}",
+        ], env=env, start_new_session=True)
+        while time.monotonic() - started < STARTUP_TIMEOUT:
+            if self.process.poll() is not None:
+                break
+            if self.healthy():
+                print(f"Warm LibreOffice instance ready after {time.monotonic() - started:.1f} seconds.")
+                return
+            time.sleep(0.5)
+        self.stop()
+        self.retry_after = time.monotonic() + RESTART_BACKOFF
+        raise Exception("Warm LibreOffice instance failed to start.")
+
+    # Stop unoserver and the soffice process it started (both share one process group)
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        except ProcessLookupError:
+            pass
+        self.process = None
+
+    def ensure_running(self):
+        if self.healthy():
+            return
+        if time.monotonic() < self.retry_after:
+            raise Exception("Warm LibreOffice instance is unavailable.")
+        if self.process is not None:
+            print("Warm LibreOffice instance is not responding, restarting it...")
+            self.stop()
+        self.start()
+
+    def convert(self, file, convert_to, outdir):
+        self.ensure_running()
+        extension, filter_name, filter_options = parse_convert_to(convert_to)
+        output_file = output_path(file, convert_to, outdir)
+        self.proxy(CONVERSION_TIMEOUT).convert(file, None, output_file, extension, filter_name, filter_options, True, None)
+        return output_file
+
+
+_warm_instance = None
+
+
+def warm_instance():
+    global _warm_instance
+    if _warm_instance is None:
+        _warm_instance = WarmLibreOffice()
+    return _warm_instance
+
+
+# Convert with one fresh soffice process (pays the LibreOffice startup on every call). soffice
+# accepts many input files at once; returns {file: output path, or the exception for that file}.
+def convert_oneshot(files, convert_to, outdir):
+    result = subprocess.run([SOFFICE, *SOFFICE_FLAGS, '--convert-to', convert_to, *files, '--outdir', outdir], capture_output=True)
+
+    if result.returncode != 0:
+        print(f"LibreOffice conversion failed with return code: {result.returncode}")
+        print(f"stderr: {result.stderr.decode()}")
+        print(f"stdout: {result.stdout.decode()}")
+
+    outputs = {}
+    for file in files:
+        output_file = output_path(file, convert_to, outdir)
+        if os.path.exists(output_file):
+            outputs[file] = output_file
+        else:
+            print(os.listdir(outdir))
+            outputs[file] = Exception(f"PDF file was not created. LibreOffice stdout: {result.stdout.decode()}, stderr: {result.stderr.decode()}")
+    return outputs
+
+
+# Split files into batches without two inputs of the same name, whose outputs would overwrite
+# each other in the shared output directory
+def unique_name_batches(files):
+    batches = []
+    for file in files:
+        name = os.path.splitext(os.path.basename(file))[0]
+        batch = next((batch for batch in batches if name not in batch), None)
+        if batch is None:
+            batch = {}
+            batches.append(batch)
+        batch[name] = file
+    return [list(batch.values()) for batch in batches]
+
+
+# Convert files that share one conversion filter. The warm instance converts them one by one
+# (LibreOffice is already running); whatever it cannot convert goes to a single one-shot soffice
+# run. Inputs with the same name are written to separate subdirectories of outdir.
+# Returns {file: output path, or the exception for that file}.
+def convert_files(files, convert_to='pdf', outdir='/tmp'):
+    outputs = {}
+    for index, batch in enumerate(unique_name_batches(files)):
+        batch_outdir = outdir if index == 0 else os.path.join(outdir, f"{index:04d}")
+        os.makedirs(batch_outdir, exist_ok=True)
+        pending = list(batch)
+        if CONVERTER_MODE == 'warm':
+            pending = []
+            for file in batch:
+                try:
+                    output_file = warm_instance().convert(file, convert_to, batch_outdir)
+                    if os.path.exists(output_file):
+                        outputs[file] = output_file
+                        continue
+                    print(f"Warm LibreOffice instance did not create {output_file}")
+                except Exception as e:
+                    print(f"Warm LibreOffice conversion of {file} failed: {e}")
+                    if not warm_instance().healthy():
+                        warm_instance().stop()
+                pending.append(file)
+            if pending:
+                print(f"Falling back to a one-shot soffice process for {len(pending)} files...")
+        if pending:
+            outputs.update(convert_oneshot(pending, convert_to, batch_outdir))
+    return outputs
+
+
+# Convert a file with LibreOffice and return the path of the output file in outdir
+def convert_file(file, convert_to='pdf', outdir='/tmp'):
+    output_file = convert_files([file], convert_to, outdir)[file]
+    if isinstance(output_file, Exception):
+        raise output_file
+    return output_file
+
+
+# (message ID, bucket, key) of every object in an S3 event, or in the S3 events carried by the
+# bodies of an SQS event. The message ID is None for direct S3 notifications.
+def s3_event_records(event):
+    for record in event.get('Records', []):
+        if 's3' in record:
+            yield None, record['s3']['bucket']['name'], urllib.parse.unquote_plus(record['s3']['object']['key'])
+        elif 'body' in record:
+            for inner in json.loads(record['body']).get('Records', []):
+                yield record['messageId'], inner['s3']['bucket']['name'], urllib.parse.unquote_plus(inner['s3']['object']['key'])
+
+
+# Convert a file to PDF with the export filter of its extension
+def convert_to_pdf(file, outdir='/tmp'):
+    print("Starting conversion to PDF...")
+    convert_to = conversion_filter(file)
+    print(f"file extension: {os.path.splitext(file)[1].lower()}, filter: {convert_to}")
+    output_file = convert_file(file, convert_to, outdir)
+    print("Conversion to PDF completed.")
+    return output_file
+
+
+# Output type of the native text extraction (see native_extractor): markdown chunk files
+MARKDOWN = 'markdown'
+
+
+# Deterministic output key of a source object: the source key with the output extension, under
+# key_prefix. Keeping the source directories means equal file names in different folders do not
+# overwrite each other, and a re-upload always lands on the same key. Markdown chunks and split
+# parts go into a folder named after the document; the key is that of the first chunk or of the
+# parts manifest.
+def output_key(source_key, convert_to, key_prefix='', split=False):
+    stem = posixpath.splitext(source_key)[0]
+    if convert_to == MARKDOWN:
+        name = f"{stem}/chunk-0001.md"
+    elif split:
+        name = f"{stem}/manifest.json"
+    else:
+        name = f"{stem}.{convert_to.split(':')[0]}"
+    return posixpath.join(key_prefix, name) if key_prefix else name
+
+
+def record_output_key(result, convert_to, key_prefix):
+    return output_key(result['key'], convert_to, key_prefix, split=result['split_parts'] and convert_to in SPLIT_FILTERS)
+
+
+def chunk_key(first_chunk_key, index):
+    return posixpath.join(posixpath.dirname(first_chunk_key), f"chunk-{index:04d}.md")
+
+
+def part_key(manifest_key, index):
+    return posixpath.join(posixpath.dirname(manifest_key), f"part-{index:04d}.pdf")
+
+
+# Split a PDF into one PDF per page (one per slide or sheet with the SPLIT_FILTERS) in outdir and
+# return their paths in page order
+def split_pdf(pdf_file, outdir):
+    from pypdf import PdfReader, PdfWriter
+
+    os.makedirs(outdir, exist_ok=True)
+    part_files = []
+    for index, page in enumerate(PdfReader(pdf_file).pages, start=1):
+        writer = PdfWriter()
+        writer.add_page(page)
+        part_file = os.path.join(outdir, f"part-{index:04d}.pdf")
+        with open(part_file, 'wb') as f:
+            writer.write(f)
+        part_files.append(part_file)
+    print(f"Split {pdf_file} into {len(part_files)} parts.")
+    return part_files
+
+
+# Ordering record of the parts of a document; consumers process the parts independently and put
+# their results back together in this order
+def parts_manifest(result, part_keys):
+    return {
+        'source': {'bucket': result['bucket'], 'key': result['key'], 'etag': result['source_etag']},
+        'convert_to': result['convert_to'],
+        'total_parts': len(part_keys),
+        'parts': [{'index': index, 'page': index, 'key': key} for index, key in enumerate(part_keys, start=1)],
+    }
+
+
+# Delete the outputs numbered above count that an earlier, longer version of the document left
+def delete_stale_outputs(output_bucket, key_for_index, count, previous_count):
+    stale = [key_for_index(index) for index in range(count + 1, previous_count + 1)]
+    if stale:
+        s3_transfer.delete_objects(output_bucket, stale)
+
+
+# Metadata stored on every output; it is what the unchanged check compares against
+def output_metadata(result, convert_to=None):
+    return {
+        'source-bucket': result['bucket'],
+        'source-key': urllib.parse.quote(result['key']),
+        'source-etag': result['source_etag'],
+        'convert-to': convert_to or result['convert_to'],
+    }
+
+
+# Download an object. With etag, the file converted must be the version whose ETag the output will
+# record: on a versioned bucket the download is pinned to version_id, otherwise the ETag is looked
+# up again afterwards and a change during the download fails the record (the upload of the new
+# version sends its own event). If-Match is not an allowed download argument of s3transfer.
+def download_from_s3(bucket, key, local_dir='/tmp', etag=None, version_id=None):
+    print(f"Downloading {key} from S3...")
+    os.makedirs(local_dir, exist_ok=True)
+    local_file = os.path.join(local_dir, os.path.basename(key))
+    s3_transfer.download_file(bucket, key, local_file, extra_args={'VersionId': version_id} if version_id else None)
+
+    if not os.path.exists(local_file):
+        raise Exception("File was not downloaded")
+
+    if etag and not version_id:
+        current = s3_transfer.head_object(bucket, key)
+        if current is None or current['ETag'].strip('"') != etag:
+            raise Exception(f"Object changed during the download (expected ETag {etag})")
+
+    print(f"Downloaded {key} from S3.")
+    return local_file
+
+
+def upload_to_s3(bucket, key, file, metadata=None):
+    print(f"Uploading {file} to S3...")
+    if not os.path.exists(file):
+        raise Exception("No such file to upload: " + file)
+    s3_transfer.upload_file(file, bucket, key, extra_args={'Metadata': metadata} if metadata else None)
+    print(f"Uploaded {file} to S3 as {key}.")
+    return key
+
+
+# Look up the source ETag and decide whether the record needs converting: it does not when the
+# output of one of its candidate conversions was made from the same source version and filter
+def prepare_record(result, output_bucket, key_prefix):
+    source = s3_transfer.head_object(result['bucket'], result['key'])
+    if source is None:
+        raise Exception("Source object does not exist")
+    result['source_etag'] = source['ETag'].strip('"')
+    # Unversioned buckets report no version ID (or 'null')
+    if source.get('VersionId') not in (None, 'null'):
+        result['source_version_id'] = source['VersionId']
+    for convert_to in result['candidates']:
+        key = record_output_key(result, convert_to, key_prefix)
+        output = s3_transfer.head_object(output_bucket, key)
+        if output is None:
+            continue
+        metadata = output.get('Metadata', {})
+        # Chunks and parts beyond the new count are removed after a re-conversion
+        if 'chunks' in metadata:
+            result['previous_chunks'] = int(metadata['chunks'])
+        if 'parts' in metadata:
+            result['previous_parts'] = int(metadata['parts'])
+        current = all(metadata.get(name) == value for name, value in output_metadata(result, convert_to).items())
+        if SKIP_UNCHANGED and current:
+            result.update(status='unchanged', convert_to=convert_to, output_key=key)
+            return
+
+
+# Extract the text of a downloaded document into markdown chunks, or switch the record to its
+# LibreOffice filter when the document's layout needs the vision path
+def extract_record(result, outdir, key_prefix):
+    import native_extractor
+
+    reason = native_extractor.layout_reason(result['local_file'])
+    if reason:
+        print(f"{result['key']} needs its layout ({reason}), converting it to PDF instead.")
+        result['convert_to'] = result['candidates'][-1]
+        result['output_key'] = record_output_key(result, result['convert_to'], key_prefix)
+        return
+    result['chunk_files'] = native_extractor.extract_markdown(result['local_file'], outdir)
+
+
+def upload_outputs(result, output_bucket):
+    metadata = output_metadata(result)
+    if 'chunk_files' in result:
+        chunk_files = result['chunk_files']
+        metadata['chunks'] = str(len(chunk_files))
+        # The first chunk is what the unchanged check reads, so it is written after all the others
+        for index in range(len(chunk_files), 0, -1):
+            upload_to_s3(output_bucket, chunk_key(result['output_key'], index), chunk_files[index - 1], metadata)
+        delete_stale_outputs(output_bucket, lambda index: chunk_key(result['output_key'], index), len(chunk_files), result.get('previous_chunks', 0))
+        result['chunks'] = len(chunk_files)
+    elif 'part_files' in result:
+        part_files = result['part_files']
+        part_keys = [part_key(result['output_key'], index) for index in range(1, len(part_files) + 1)]
+        for index, (part_file, key) in enumerate(zip(part_files, part_keys), start=1):
+            part_metadata = {'manifest-key': urllib.parse.quote(result['output_key']), 'part-index': str(index), 'total-parts': str(len(part_files))}
+            upload_to_s3(output_bucket, key, part_file, {**metadata, **part_metadata})
+        # The manifest is what the unchanged check reads and what consumers wait for: written last
+        manifest_file = os.path.join(os.path.dirname(result['output_file']), f"{os.path.basename(result['output_file'])}.manifest.json")
+        with open(manifest_file, 'w') as f:
+            json.dump(parts_manifest(result, part_keys), f, indent=2)
+        upload_to_s3(output_bucket, result['output_key'], manifest_file, {**metadata, 'parts': str(len(part_files))})
+        delete_stale_outputs(output_bucket, lambda index: part_key(result['output_key'], index), len(part_files), result.get('previous_parts', 0))
+        result['parts'] = len(part_files)
+    else:
+        upload_to_s3(output_bucket, result['output_key'], result['output_file'], metadata)
+
+
+# Convert every object of an event to PDF in output_bucket under key_prefix (see output_key).
+# All objects are checked and downloaded concurrently, files that share a filter are converted in
+# one run, and the outputs are uploaded concurrently with the source ETag in their metadata.
+# Objects whose output is current are skipped. With extract_native, documents native_extractor
+# can read are turned into markdown chunks directly, and only those whose layout needs it go
+# through LibreOffice. With split_parts, presentations and workbooks are uploaded as one PDF per
+# slide / sheet plus a manifest (see SPLIT_PARTS). Returns one result per record; a failing record
+# does not stop the others.
+def convert_records(records, output_bucket, key_prefix='', workers=MAX_TRANSFER_WORKERS, extract_native=False, split_parts=SPLIT_PARTS):
+    if extract_native:
+        import native_extractor
+    workdir = tempfile.mkdtemp(prefix='convert-', dir='/tmp')
+    results = []
+    for message_id, bucket, key in records:
+        candidates = [conversion_filter(key)]
+        if extract_native and native_extractor.can_extract(key):
+            candidates.insert(0, MARKDOWN)
+        result = {'message_id': message_id, 'bucket': bucket, 'key': key, 'status': 'failed', 'candidates': candidates, 'split_parts': split_parts}
+        result.update(convert_to=candidates[0], output_key=record_output_key(result, candidates[0], key_prefix))
+        results.append(result)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            checks = {executor.submit(prepare_record, result, output_bucket, key_prefix): result for result in results}
+            for future in as_completed(checks):
+                try:
+                    future.result()
+                except Exception as e:
+                    checks[future]['error'] = f"Source lookup failed: {e}"
+            pending = [result for result in results if result['status'] == 'failed' and 'error' not in result]
+
+            # Every record gets its own input directory, so equal file names cannot collide
+            downloads = {
+                executor.submit(download_from_s3, result['bucket'], result['key'], os.path.join(workdir, f"{i:04d}"), result['source_etag'], result.get('source_version_id')): result
+                for i, result in enumerate(pending)
+            }
+            downloaded = []
+            for future in as_completed(downloads):
+                result = downloads[future]
+                try:
+                    result['local_file'] = future.result()
+                    downloaded.append(result)
+                except Exception as e:
+                    result['error'] = f"Download failed: {e}"
+
+            extractions = {
+                executor.submit(extract_record, result, os.path.join(os.path.dirname(result['local_file']), 'chunks'), key_prefix): result
+                for result in downloaded if result['convert_to'] == MARKDOWN
+            }
+            for future in as_completed(extractions):
+                try:
+                    future.result()
+                except Exception as e:
+                    extractions[future]['error'] = f"Extraction failed: {e}"
+
+            groups = {}
+            for result in downloaded:
+                if result['convert_to'] != MARKDOWN:
+                    groups.setdefault(result['convert_to'], []).append(result)
+
+            # Each filter group converts into its own directory, so outputs of a.docx and a.xlsx differ
+            for index, (convert_to, group) in enumerate(groups.items()):
+                print(f"Converting {len(group)} files with {convert_to}...")
+                outdir = os.path.join(workdir, f"out-{index:02d}")
+                outputs = convert_files([result['local_file'] for result in group], convert_to, outdir)
+                for result in group:
+                    output = outputs[result['local_file']]
+                    if isinstance(output, Exception):
+                        result['error'] = f"Conversion failed: {output}"
+                    else:
+                        result['output_file'] = output
+
+            splits = {
+                executor.submit(split_pdf, result['output_file'], os.path.join(os.path.dirname(result['local_file']), 'parts')): result
+                for result in results if 'output_file' in result and result['output_key'].endswith('/manifest.json')
+            }
+            for future in as_completed(splits):
+                result = splits[future]
+                try:
+                    result['part_files'] = future.result()
+                except Exception as e:
+                    result['error'] = f"Split failed: {e}"
+                    del result['output_file']
+
+            uploads = {
+                executor.submit(upload_outputs, result, output_bucket): result
+                for result in results if 'output_file' in result or 'chunk_files' in result
+            }
+            for future in as_completed(uploads):
+                result = uploads[future]
+                try:
+                    future.result()
+                    result['status'] = 'converted'
+                except Exception as e:
+                    result['error'] = f"Upload failed: {e}"
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for result in results:
+        for name in ('candidates', 'split_parts', 'source_version_id', 'previous_chunks', 'previous_parts', 'local_file', 'output_file', 'chunk_files', 'part_files'):
+            result.pop(name, None)
+        if result['status'] == 'failed':
+            result.pop('output_key')
+        print(f"{result['key']}: {result['status']} {result.get('output_key') or result.get('error')}")
+    return results
+
+
+# Lambda response for a batch of results; batchItemFailures lets an SQS event source mapping with
+# ReportBatchItemFailures retry only the messages that had a failing object. Direct S3 (async)
+# invocations have no message to report, so a failure there is raised instead, which makes Lambda
+# retry the event and send it to the DLQ / failure destination once retries run out.
+def batch_response(results):
+    failed = [result for result in results if result['status'] == 'failed']
+    unchanged = sum(1 for result in results if result['status'] == 'unchanged')
+    response = {
+        "statusCode": 200 if not failed else 207,
+        "body": f"Converted {len(results) - len(failed) - unchanged} of {len(results)} files, {unchanged} unchanged",
+        "results": results,
+    }
+    if any(result['message_id'] for result in results):
+        failed_messages = dict.fromkeys(result['message_id'] for result in failed if result['message_id'])
+        response["batchItemFailures"] = [{"itemIdentifier": message_id} for message_id in failed_messages]
+    unreported = [result['key'] for result in failed if not result['message_id']]
+    if unreported:
+        print(response["body"])
+        raise Exception(f"Failed to convert {len(unreported)} files: {', '.join(unreported)}")
+    return response
@@ -0,0 +1,67 @@
+import os
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# S3 transfers shared by the office converter Lambdas. One client per execution environment keeps
+# its connection pool warm across calls and invocations; large objects are moved as parallel
+# ranged GETs / multipart uploads.
+
+MB = 1024 * 1024
+
+# Objects above the threshold are split into chunks moved by max_concurrency threads
+transfer_config = TransferConfig(
+    multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '16')) * MB,
+    multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', '16')) * MB,
+    max_concurrency=int(os.getenv('S3_MAX_CONCURRENCY', '16')),
+    use_threads=True,
+)
+
+# Room for the transfer threads of several concurrent transfers
+client_config = Config(
+    max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '64')),
+    retries={'mode': 'standard', 'max_attempts': 5},
+)
+
+# S3_ENDPOINT_URL points the client at a local S3 stand-in (tests and benchmarks)
+s3_client = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT_URL') or None, config=client_config)
+
+
+def download_file(bucket, key, local_file, extra_args=None):
+    s3_client.download_file(bucket, key, local_file, ExtraArgs=extra_args, Config=transfer_config)
+    return local_file
+
+
+def upload_file(local_file, bucket, key, extra_args=None):
+    s3_client.upload_file(local_file, bucket, key, ExtraArgs=extra_args, Config=transfer_config)
+    return key
+
+
+# Stream an object into a writable file object (a pipe to a tool's stdin, an in-memory buffer)
+# without an intermediate file; ranged GETs still run in parallel
+def download_fileobj(bucket, key, fileobj):
+    s3_client.download_fileobj(bucket, key, fileobj, Config=transfer_config)
+    return fileobj
+
+
+# Stream a readable file object (a tool's stdout, an in-memory buffer) to S3 as a multipart upload
+def upload_fileobj(fileobj, bucket, key, extra_args=None):
+    s3_client.upload_fileobj(fileobj, bucket, key, ExtraArgs=extra_args, Config=transfer_config)
+    return key
+
+
+# Object metadata (ETag, Metadata, ...) or None when the object does not exist
+def head_object(bucket, key):
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def delete_objects(bucket, keys):
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True})
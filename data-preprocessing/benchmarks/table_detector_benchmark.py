@@ -0,0 +1,120 @@
+"""
+Benchmark the local table boundary detector against the Bedrock layout classification.
+
+For every page of every PDF in a folder this runs `detect_table_boundaries` and, unless
+--no-model is given, `classify_page_layout`, then reports how often the detector was
+confident, how often it agreed with the model, and the latency of both.
+
+Usage:
+    python table_detector_benchmark.py <pdf_folder> [--no-model] [--output results.json]
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+# handler.py (only imported for the model comparison) builds its AWS clients at import time from
+# these; the benchmark never touches S3 or SQS
+os.environ.setdefault('SQS_QUEUE_URL', 'unused')
+os.environ.setdefault('OUTPUT_BUCKET', 'unused')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', os.environ['AWS_REGION'])
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'pdf_processor'))
+
+import fitz  # noqa: E402
+from page_render import render_page  # noqa: E402
+from table_detector import detect_table_boundaries  # noqa: E402
+
+FLAGS = ("starts_with_table", "ends_with_table")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "mean_ms": statistics.mean(values) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+    }
+
+
+def benchmark_pdf(pdf_file, use_model):
+    if use_model:
+        from handler import classify_page_layout
+    pages = []
+    pdf_document = fitz.open(pdf_file)
+    try:
+        for page_num in range(len(pdf_document)):
+            start = time.perf_counter()
+            local = detect_table_boundaries(pdf_document.load_page(page_num))
+            local_ms = (time.perf_counter() - start) * 1000
+
+            model, model_ms = None, None
+            if use_model:
+                image = render_page(pdf_document, page_num)
+                start = time.perf_counter()
+                model = classify_page_layout(image)
+                model_ms = (time.perf_counter() - start) * 1000
+
+            pages.append({"page": page_num + 1, "local": local, "local_ms": local_ms, "model": model, "model_ms": model_ms})
+    finally:
+        pdf_document.close()
+    return pages
+
+
+def summarize(results):
+    pages = [page for document in results.values() for page in document]
+    summary = {"documents": len(results), "pages": len(pages), "flags": {}}
+    for flag in FLAGS:
+        confident = [page for page in pages if page["local"][flag] is not None]
+        compared = [page for page in confident if page["model"] is not None]
+        agreed = [page for page in compared if page["local"][flag] == page["model"][flag]]
+        summary["flags"][flag] = {
+            "confident": len(confident),
+            "coverage": len(confident) / len(pages) if pages else None,
+            "compared": len(compared),
+            "agreement": len(agreed) / len(compared) if compared else None,
+            "disagreements": [
+                {"page": page["page"], "local": page["local"][flag], "model": page["model"][flag]}
+                for page in compared if page["local"][flag] != page["model"][flag]
+            ],
+        }
+    # A model call is only needed for a page when at least one flag stayed uncertain
+    summary["model_calls_avoided"] = sum(1 for page in pages if None not in page["local"].values())
+    summary["local_latency"] = latency_summary([page["local_ms"] for page in pages])
+    summary["model_latency"] = latency_summary([page["model_ms"] for page in pages if page["model_ms"] is not None])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local table boundary detector.")
+    parser.add_argument("pdf_folder", help="Folder containing sample PDF files")
+    parser.add_argument("--no-model", action="store_true", help="Only time the local detector, skip Bedrock")
+    parser.add_argument("--output", help="Write per-page results and the summary to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for pdf_file in sorted(glob.glob(os.path.join(args.pdf_folder, "*.pdf"))):
+        print(f"Benchmarking {pdf_file}")
+        results[os.path.basename(pdf_file)] = benchmark_pdf(pdf_file, use_model=not args.no_model)
+
+    summary = summarize(results)
+    print(json.dumps(summary, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "pages": results}, f, indent=4)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
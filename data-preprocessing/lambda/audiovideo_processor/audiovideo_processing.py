@@ -1,5 +1,6 @@
 import boto3
 import cv2
+import numpy as np
 import os
 import json
 import logging
@@ -14,56 +15,198 @@ transcribe = boto3.client('transcribe')
 frames_bucket = os.environ['FRAMES_BUCKET']
 audio_bucket = os.environ['AUDIO_BUCKET']
 
+# Frames sent to Rekognition: fps (SAMPLE_FPS frames per second), keyframes (the video's I-frames),
+# scene (a frame whenever the picture changes, see SCENE_METHOD) or all (every frame)
+FRAME_SAMPLING = os.getenv('FRAME_SAMPLING', 'fps').lower()
+SAMPLE_FPS = float(os.getenv('SAMPLE_FPS', '1'))
+
+# Scene change detection: histogram (Bhattacharyya distance of hue / saturation histograms, 0-1)
+# or phash (Hamming distance of 64 bit perceptual hashes); frames are compared SCENE_CHECK_FPS times
+# per second and sampled at most every MIN_SCENE_INTERVAL seconds
+SCENE_METHOD = os.getenv('SCENE_METHOD', 'histogram').lower()
+DEFAULT_SCENE_THRESHOLDS = {'histogram': 0.35, 'phash': 12}
+SCENE_THRESHOLD = float(os.environ['SCENE_THRESHOLD']) if os.getenv('SCENE_THRESHOLD') else None
+SCENE_CHECK_FPS = float(os.getenv('SCENE_CHECK_FPS', '4'))
+MIN_SCENE_INTERVAL = float(os.getenv('MIN_SCENE_INTERVAL', '1'))
+
+# Upper bound of Rekognition calls per video
+MAX_SAMPLED_FRAMES = int(os.getenv('MAX_SAMPLED_FRAMES', '1800'))
+JPEG_QUALITY = 90
+
+# Frame rate assumed when the container does not report one
+DEFAULT_FPS = 30.0
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def analyze_frames(video_file, context):
+def sample_all_frames(video):
     """
-    Analyzes frames in the video file using Amazon Rekognition.
-    This version ensures unique file names for each invocation using aws_request_id.
+    Yields every decoded frame of the video as (frame index, timestamp in seconds, frame).
+    """
+    fps = video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    frame_index = 0
+    while True:
+        ret, frame = video.read()
+        if not ret:
+            break
+        yield frame_index, frame_index / fps, frame
+        frame_index += 1
+
+
+def sample_fixed_fps(video, sample_fps):
+    """
+    Yields frames at a fixed rate of sample_fps frames per second.
+
+    Skipped frames are only grabbed (demuxed and decoded by the backend), never retrieved as
+    images, so they cost no color conversion and are never encoded.
+    """
+    fps = video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    interval = max(fps / sample_fps, 1)
+    next_sample = 0.0
+    frame_index = 0
+    while video.grab():
+        if frame_index >= next_sample:
+            ret, frame = video.retrieve()
+            if ret:
+                yield frame_index, frame_index / fps, frame
+            next_sample += interval
+        frame_index += 1
+
+
+def sample_keyframes(video_file):
+    """
+    Yields only the keyframes (I-frames) of the video.
+
+    Uses PyAV with the decoder told to skip every non-key frame, so the frames in between are
+    not even decoded.
+    """
+    import av
+
+    with av.open(video_file) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = 'NONKEY'
+        fps = float(stream.average_rate or DEFAULT_FPS)
+        for frame in container.decode(stream):
+            timestamp = float(frame.time) if frame.time is not None else 0.0
+            yield round(timestamp * fps), timestamp, frame.to_ndarray(format='bgr24')
+
+
+def frame_histogram(frame):
+    """
+    Normalized hue / saturation histogram of a frame, compared with the Bhattacharyya distance
+    (0 for identical color distributions, 1 for disjoint ones).
+    """
+    hsv = cv2.cvtColor(cv2.resize(frame, (160, 90)), cv2.COLOR_BGR2HSV)
+    histogram = cv2.calcHist([hsv], [0, 1], None, [50, 60], [0, 180, 0, 256])
+    return cv2.normalize(histogram, histogram).flatten()
+
+
+def frame_phash(frame):
+    """
+    64 bit perceptual hash of a frame (sign of the low frequency DCT coefficients against their
+    median), compared with the Hamming distance.
+    """
+    gray = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+    low_frequencies = cv2.dct(np.float32(gray))[:8, :8]
+    return (low_frequencies > np.median(low_frequencies)).flatten()
+
+
+SCENE_SIGNATURES = {
+    'histogram': (frame_histogram, lambda a, b: cv2.compareHist(a, b, cv2.HISTCMP_BHATTACHARYYA)),
+    'phash': (frame_phash, lambda a, b: int(np.count_nonzero(a != b))),
+}
+
+
+def sample_scene_changes(video, method, threshold, check_fps, min_interval):
+    """
+    Yields the first frame and every frame whose signature (see SCENE_SIGNATURES) differs from
+    that of the last sampled frame by more than threshold.
+
+    Frames are compared at check_fps frames per second; the others are only grabbed. Comparing
+    with the last sampled frame rather than the previous one also catches slow fades and pans.
+    A new sample is taken at most every min_interval seconds.
+    """
+    signature, distance = SCENE_SIGNATURES[method]
+    last_signature = None
+    last_timestamp = None
+    for frame_index, timestamp, frame in sample_fixed_fps(video, check_fps):
+        current = signature(frame)
+        if last_signature is not None:
+            if timestamp - last_timestamp < min_interval or distance(last_signature, current) <= threshold:
+                continue
+        last_signature, last_timestamp = current, timestamp
+        yield frame_index, timestamp, frame
+
+
+def sample_frames(video_file, sampling):
+    """
+    Picks the frame sampler for a sampling mode.
+
+    Args:
+    - video_file: Path to the video file.
+    - sampling: fps, keyframes, scene or all (see FRAME_SAMPLING).
+
+    Returns:
+    - An iterator of (frame index, timestamp in seconds, BGR frame) and the VideoCapture to
+      release afterwards (None for the keyframe sampler).
+    """
+    if sampling == 'keyframes':
+        return sample_keyframes(video_file), None
+    video = cv2.VideoCapture(video_file)
+    if sampling == 'fps':
+        return sample_fixed_fps(video, SAMPLE_FPS), video
+    if sampling == 'scene':
+        threshold = SCENE_THRESHOLD if SCENE_THRESHOLD is not None else DEFAULT_SCENE_THRESHOLDS[SCENE_METHOD]
+        return sample_scene_changes(video, SCENE_METHOD, threshold, SCENE_CHECK_FPS, MIN_SCENE_INTERVAL), video
+    if sampling == 'all':
+        return sample_all_frames(video), video
+    raise ValueError(f"Unknown frame sampling mode: {sampling}")
+
+
+def analyze_frames(video_file, context, sampling=None):
+    """
+    Analyzes sampled frames of the video file using Amazon Rekognition.
+    Only the frames picked by the sampler are encoded (as JPEG, in memory) and sent to
+    Rekognition; the others are never encoded.
     
     Args:
     - video_file: Path to the video file.
-    - context: Lambda context object to access aws_request_id for unique file naming.
+    - context: Lambda context object (kept for the handler's call signature).
+    - sampling: Frame sampling mode, defaults to FRAME_SAMPLING.
     
     Returns:
-    - video_labels: A list of labels detected for each frame.
+    - video_labels: A list with the frame index, timestamp (seconds) and labels of each sampled frame.
     """
-    print(f"Starting frame analysis for {video_file}")
-    video = cv2.VideoCapture(video_file)
-    frame_counter = 0
+    sampling = sampling or FRAME_SAMPLING
+    print(f"Starting frame analysis for {video_file} (sampling: {sampling})")
+    frames, video = sample_frames(video_file, sampling)
     video_labels = []
-    
-    while video.isOpened():
-        ret, frame = video.read()
-        if not ret:
-            print(f"End of video reached after {frame_counter} frames.")
-            break
-        frame_counter += 1
 
-        # Use aws_request_id for unique file names
-        frame_filename = f'/tmp/frame_{frame_counter}_{context.aws_request_id}.jpg'
-        cv2.imwrite(frame_filename, frame)
-        print(f"Frame {frame_counter} saved as {frame_filename}")
-        
-        # Process the frame using Rekognition
-        with open(frame_filename, 'rb') as image:
+    try:
+        for frame_index, timestamp, frame in frames:
+            if len(video_labels) >= MAX_SAMPLED_FRAMES:
+                print(f"Reached the limit of {MAX_SAMPLED_FRAMES} sampled frames.")
+                break
+
+            ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ret:
+                print(f"Frame {frame_index} could not be encoded, skipping it.")
+                continue
+
             rekognition_response = rekognition.detect_labels(
-                Image={'Bytes': image.read()}, MaxLabels=10, MinConfidence=70
+                Image={'Bytes': jpeg.tobytes()}, MaxLabels=10, MinConfidence=70
             )
             labels = [label['Name'] for label in rekognition_response['Labels']]
-            video_labels.append({f'Frame {frame_counter}': labels})
-            print(f"Rekognition labels for frame {frame_counter}: {labels}")
-        
-        # Clean up the frame file after processing
-        os.remove(frame_filename)
-        print(f"Frame {frame_counter} file deleted from /tmp")
+            video_labels.append({'frame': frame_index, 'timestamp': round(timestamp, 3), 'labels': labels})
+            print(f"Rekognition labels for frame {frame_index} at {timestamp:.2f}s: {labels}")
+    finally:
+        if video is not None:
+            video.release()
 
-    video.release()
-    logger.info(f'Total frames analyzed: {frame_counter}')
-    print(f"Frame analysis completed for {frame_counter} frames.")
+    logger.info(f'Total frames analyzed: {len(video_labels)}')
+    print(f"Frame analysis completed for {len(video_labels)} sampled frames.")
     return video_labels
 
 
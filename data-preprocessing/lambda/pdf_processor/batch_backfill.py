@@ -0,0 +1,297 @@
+"""
+Offline backfill of PDF transcriptions through Bedrock batch inference.
+
+Reprocessing an archive page by page through the pdf_processor Lambda makes one on-demand
+model call per page and runs into throttling for days. This tool does the same work as a
+Bedrock batch inference job instead, in four stages:
+
+    prepare   render every page of a set of PDFs and write the batch JSONL records plus a
+              manifest (pages with a clean text layer are converted locally, as in the Lambda)
+    submit    upload the records and start a create_model_invocation_job
+    wait      poll the job until it reaches a final state
+    assemble  rebuild one "<source_key>.txt" per document from the *.jsonl.out results, in the
+              same "Page N" layout the Lambda writes to the output bucket
+
+Pages are transcribed independently: records of a batch job cannot depend on each other, so
+the previous-page text the Lambda carries into table continuations is not available here.
+
+Usage:
+    python batch_backfill.py prepare --workdir backfill s3://bucket/a.pdf s3://bucket/b.pdf
+    python batch_backfill.py submit --workdir backfill --input-uri s3://staging/in/ \\
+        --output-uri s3://staging/out/ --role-arn arn:aws:iam::...:role/batch --job-name backfill-1
+    python batch_backfill.py wait --job-arn arn:aws:bedrock:...
+    python batch_backfill.py assemble --workdir backfill --results s3://staging/out/<job-id>/ \\
+        --output-bucket knowledge-base-bucket
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import time
+
+import fitz  # PyMuPDF library for PDF processing
+
+from model_router import COMPLEX_PAGE_MODEL_ID
+from page_render import render_page
+from prompts import FIRST_PAGE_PROMPT, TRANSCRIPTION_SYSTEM_PROMPT, split_layout_marker
+from text_layer import is_simple_text_page, page_to_markdown, score_text_layer
+
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+
+# Same inference parameters as the Lambda's converse calls
+MAX_TOKENS = 4096
+TEMPERATURE = 0.0
+TOP_P = 0.45
+
+# Bedrock batch inference accepts at most this many records per input file
+MAX_RECORDS_PER_FILE = 50000
+
+# Job states after which the job no longer changes
+FINAL_JOB_STATES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+MANIFEST_FILE = "manifest.json"
+
+
+# Record IDs are 11 alphanumeric characters: 5 digits of document index, 6 digits of page index
+def record_id(document_index, page_num):
+    return f"{document_index:05d}{page_num:06d}"
+
+
+# One batch record: an InvokeModel request body for the Anthropic messages API
+def page_record(record_id, image, model_id=COMPLEX_PAGE_MODEL_ID):
+    return {
+        "recordId": record_id,
+        "modelInput": {
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": MAX_TOKENS,
+            "temperature": TEMPERATURE,
+            "top_p": TOP_P,
+            "system": TRANSCRIPTION_SYSTEM_PROMPT,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": f"image/{image['format']}",
+                            "data": base64.b64encode(image["bytes"]).decode("ascii"),
+                        },
+                    },
+                    {"type": "text", "text": FIRST_PAGE_PROMPT},
+                ],
+            }],
+        },
+    }
+
+
+# Render one PDF into batch records. Returns the document's manifest entry; fast-path pages are
+# converted here and stored in the manifest instead of becoming records.
+def render_document_records(pdf_path, document_index, write_record, model_id=COMPLEX_PAGE_MODEL_ID, fast_path=True):
+    entry = {"document_index": document_index, "pages": 0, "fast_path": {}}
+    pdf_document = fitz.open(pdf_path)
+    try:
+        entry["pages"] = len(pdf_document)
+        for page_num in range(len(pdf_document)):
+            if fast_path:
+                page = pdf_document.load_page(page_num)
+                if is_simple_text_page(score_text_layer(page)):
+                    entry["fast_path"][str(page_num)] = page_to_markdown(page)
+                    continue
+            image = render_page(pdf_document, page_num, model_id=model_id)
+            write_record(page_record(record_id(document_index, page_num), image, model_id))
+    finally:
+        pdf_document.close()
+    return entry
+
+
+# Write the batch input files (records-NNNN.jsonl) and the manifest for a list of documents, each
+# a dict with "pdf_path" and the "source_bucket" / "source_key" it was read from. Returns the manifest.
+def build_batch_input(documents, workdir, model_id=COMPLEX_PAGE_MODEL_ID, fast_path=True, max_records_per_file=MAX_RECORDS_PER_FILE):
+    os.makedirs(workdir, exist_ok=True)
+    state = {"file": None, "records": 0, "files": []}
+
+    def write_record(record):
+        if state["file"] is None or state["records"] >= max_records_per_file:
+            if state["file"] is not None:
+                state["file"].close()
+            path = os.path.join(workdir, f"records-{len(state['files']):04d}.jsonl")
+            state["files"].append(os.path.basename(path))
+            state["file"] = open(path, "w")
+            state["records"] = 0
+        state["file"].write(json.dumps(record) + "\n")
+        state["records"] += 1
+
+    manifest = {"model_id": model_id, "documents": [], "input_files": state["files"]}
+    try:
+        for document_index, document in enumerate(documents):
+            entry = render_document_records(document["pdf_path"], document_index, write_record, model_id, fast_path)
+            entry.update(
+                source_bucket=document.get("source_bucket"),
+                source_key=document.get("source_key"),
+                s3_output_key=f"{document.get('source_key') or os.path.basename(document['pdf_path'])}.txt",
+            )
+            manifest["documents"].append(entry)
+            print(f"Rendered {entry['pages']} pages of {document['pdf_path']} ({len(entry['fast_path'])} on the fast path)")
+    finally:
+        if state["file"] is not None:
+            state["file"].close()
+
+    with open(os.path.join(workdir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def submit_batch_job(bedrock_client, job_name, role_arn, model_id, input_s3_uri, output_s3_uri, timeout_hours=None):
+    request = {
+        "jobName": job_name,
+        "roleArn": role_arn,
+        "modelId": model_id,
+        "inputDataConfig": {"s3InputDataConfig": {"s3Uri": input_s3_uri, "s3InputFormat": "JSONL"}},
+        "outputDataConfig": {"s3OutputDataConfig": {"s3Uri": output_s3_uri}},
+    }
+    if timeout_hours:
+        request["timeoutDurationInHours"] = timeout_hours
+    response = bedrock_client.create_model_invocation_job(**request)
+    print(f"Submitted batch job {job_name}: {response['jobArn']}")
+    return response["jobArn"]
+
+
+def wait_for_batch_job(bedrock_client, job_arn, poll_seconds=60, sleep=time.sleep):
+    while True:
+        job = bedrock_client.get_model_invocation_job(jobIdentifier=job_arn)
+        print(f"Batch job {job_arn}: {job['status']}")
+        if job["status"] in FINAL_JOB_STATES:
+            return job
+        sleep(poll_seconds)
+
+
+# Parse *.jsonl.out lines into {record_id: text}; records that failed map to None
+def read_batch_outputs(lines):
+    outputs = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        output = result.get("modelOutput")
+        if output is None or result.get("error"):
+            print(f"Record {result.get('recordId')} failed: {result.get('error')}")
+            outputs[result["recordId"]] = None
+            continue
+        text = "".join(block.get("text", "") for block in output.get("content", []) if block.get("type") == "text")
+        outputs[result["recordId"]] = split_layout_marker(text)[0]
+    return outputs
+
+
+# Rebuild each document's text in the Lambda's output layout. Yields (entry, text, missing_pages);
+# text is None for documents with pages that have no successful result.
+def reassemble_documents(manifest, outputs):
+    for entry in manifest["documents"]:
+        pages, missing = [], []
+        for page_num in range(entry["pages"]):
+            text = entry["fast_path"].get(str(page_num))
+            if text is None:
+                text = outputs.get(record_id(entry["document_index"], page_num))
+            if text is None:
+                missing.append(page_num + 1)
+            pages.append(f"Page {page_num + 1}\n{text}\n\n")
+        yield entry, None if missing else "".join(pages), missing
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def read_result_lines(s3_client, results):
+    if results.startswith("s3://"):
+        bucket, prefix = split_s3_uri(results)
+        for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(".jsonl.out"):
+                    yield from s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].iter_lines()
+    else:
+        for path in sorted(glob.glob(os.path.join(results, "*.jsonl.out"))):
+            with open(path) as f:
+                yield from f
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill PDF transcriptions with Bedrock batch inference")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prepare = commands.add_parser("prepare")
+    prepare.add_argument("sources", nargs="+", help="s3://bucket/key.pdf URIs or local PDF paths")
+    prepare.add_argument("--workdir", required=True)
+    prepare.add_argument("--model-id", default=COMPLEX_PAGE_MODEL_ID)
+    prepare.add_argument("--no-fast-path", action="store_true")
+
+    submit = commands.add_parser("submit")
+    submit.add_argument("--workdir", required=True)
+    submit.add_argument("--input-uri", required=True)
+    submit.add_argument("--output-uri", required=True)
+    submit.add_argument("--role-arn", required=True)
+    submit.add_argument("--job-name", required=True)
+    submit.add_argument("--timeout-hours", type=int)
+
+    wait = commands.add_parser("wait")
+    wait.add_argument("--job-arn", required=True)
+    wait.add_argument("--poll-seconds", type=int, default=60)
+
+    assemble = commands.add_parser("assemble")
+    assemble.add_argument("--workdir", required=True)
+    assemble.add_argument("--results", required=True, help="s3:// prefix or local folder with *.jsonl.out files")
+    assemble.add_argument("--output-bucket", help="Write the documents to this bucket instead of --workdir")
+    args = parser.parse_args()
+
+    # Only the CLI talks to AWS; the stages above take their clients as arguments
+    import boto3
+    s3_client = boto3.client("s3")
+
+    if args.command == "prepare":
+        documents = []
+        for source in args.sources:
+            if source.startswith("s3://"):
+                bucket, key = split_s3_uri(source)
+                pdf_path = os.path.join(args.workdir, "pdfs", key)
+                os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+                s3_client.download_file(bucket, key, pdf_path)
+                documents.append({"pdf_path": pdf_path, "source_bucket": bucket, "source_key": key})
+            else:
+                documents.append({"pdf_path": source})
+        build_batch_input(documents, args.workdir, args.model_id, fast_path=not args.no_fast_path)
+
+    elif args.command == "submit":
+        with open(os.path.join(args.workdir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        bucket, prefix = split_s3_uri(args.input_uri)
+        for name in manifest["input_files"]:
+            s3_client.upload_file(os.path.join(args.workdir, name), bucket, prefix + name)
+        submit_batch_job(boto3.client("bedrock"), args.job_name, args.role_arn, manifest["model_id"],
+                         args.input_uri, args.output_uri, args.timeout_hours)
+
+    elif args.command == "wait":
+        job = wait_for_batch_job(boto3.client("bedrock"), args.job_arn, args.poll_seconds)
+        print(json.dumps({key: job.get(key) for key in ("status", "message", "outputDataConfig")}, default=str))
+
+    elif args.command == "assemble":
+        with open(os.path.join(args.workdir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        outputs = read_batch_outputs(read_result_lines(s3_client, args.results))
+        for entry, text, missing in reassemble_documents(manifest, outputs):
+            if text is None:
+                print(f"Skipping {entry['s3_output_key']}: no result for pages {missing}")
+            elif args.output_bucket:
+                s3_client.put_object(Bucket=args.output_bucket, Key=entry["s3_output_key"], Body=text.encode("utf-8"))
+                print(f"Wrote s3://{args.output_bucket}/{entry['s3_output_key']}")
+            else:
+                path = os.path.join(args.workdir, "output", entry["s3_output_key"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    f.write(text)
+                print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
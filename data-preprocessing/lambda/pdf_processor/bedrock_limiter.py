@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+
+
+# Bedrock error codes that mean "slow down and try again" rather than a bad request
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ServiceUnavailable",
+    "ModelNotReadyException",
+}
+
+
+# Token bucket that hands out reservations instead of blocking: the balance may go negative and
+# every caller is told how long to wait for its share, so concurrent callers queue up fairly.
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity, clock=time.monotonic):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+        self.updated = now
+
+    # Take amount tokens and return the number of seconds the caller has to wait before using them
+    def reserve(self, amount):
+        self._refill()
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate_per_second
+
+    # Give back (positive) or take (negative) tokens once the real cost of a call is known
+    def adjust(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+# Client-side rate limiter for Bedrock shared by every model call of the process. It enforces
+# requests per second and tokens per minute, and adapts both rates to throttling responses:
+# a throttle halves the allowed rate, every success wins back 5% of the configured maximum.
+class BedrockRateLimiter:
+    def __init__(self, requests_per_second, tokens_per_minute, initial_token_estimate=2000,
+                 min_scale=0.05, max_backoff=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.max_requests_per_second = requests_per_second
+        self.max_tokens_per_minute = tokens_per_minute
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second), clock)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute, clock)
+        self.token_estimate = initial_token_estimate
+        self.min_scale = min_scale
+        self.max_backoff = max_backoff
+        self.scale = 1.0
+        self.sleep = sleep
+        self._lock = threading.Lock()
+
+    def _apply_scale(self):
+        self.requests.rate_per_second = self.max_requests_per_second * self.scale
+        self.tokens.rate_per_second = self.max_tokens_per_minute / 60.0 * self.scale
+
+    # Block until a request is allowed; returns the token estimate reserved for it
+    def acquire(self):
+        with self._lock:
+            estimate = self.token_estimate
+            wait = max(self.requests.reserve(1), self.tokens.reserve(estimate))
+        if wait > 0:
+            self.sleep(wait)
+        return estimate
+
+    # Settle a reservation with the tokens the response reported (0 when the call failed)
+    def record_usage(self, estimate, actual_tokens):
+        with self._lock:
+            self.tokens.adjust(estimate - actual_tokens)
+            if actual_tokens:
+                # Exponential moving average of the real cost of a call
+                self.token_estimate = int(0.8 * self.token_estimate + 0.2 * actual_tokens)
+
+    def on_success(self):
+        with self._lock:
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + 0.05)
+                self._apply_scale()
+
+    # Cut the allowed rate and return a full-jitter backoff delay for the given retry attempt
+    def on_throttle(self, attempt, base_delay):
+        with self._lock:
+            self.scale = max(self.min_scale, self.scale / 2)
+            self._apply_scale()
+        return random.uniform(0, min(self.max_backoff, base_delay * 2 ** attempt))
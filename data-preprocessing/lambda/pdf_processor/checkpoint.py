@@ -0,0 +1,184 @@
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+
+import botocore
+from botocore.exceptions import ClientError
+
+
+# Checkpoint records stored as JSON objects in S3. Updates are conditional writes (If-Match on the
+# ETag, If-None-Match for a new record), so concurrent page-range workers of one document never
+# overwrite each other's progress. Needs a botocore whose PutObject accepts IfMatch (pinned in the
+# pdfprocessing layer); an older one is reported at construction instead of on every write.
+class S3CheckpointStore:
+    def __init__(self, s3_client, bucket):
+        put_object = s3_client.meta.service_model.operation_model("PutObject").input_shape.members
+        if "IfMatch" not in put_object or "IfNoneMatch" not in put_object:
+            raise Exception(
+                f"botocore {botocore.__version__} does not support S3 conditional writes, which the S3 checkpoint "
+                "store needs: install botocore>=1.35.99 (see the pdfprocessing layer) or set CHECKPOINT_STORE=local"
+            )
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    # Return (record, version) or (None, None) when there is no record yet
+    def read(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return None, None
+        return json.loads(response["Body"].read()), response["ETag"]
+
+    # Write the record if it is still at version; returns False when someone else updated it first
+    def write(self, key, record, version):
+        condition = {"IfMatch": version} if version else {"IfNoneMatch": "*"}
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(record), ContentType="application/json", **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409"):
+                return False
+            raise
+        return True
+
+
+# Local stand-in for the S3 store, one JSON file per record under a directory. A version counter
+# kept in the file plays the role of the ETag; an flock makes the compare-and-write atomic.
+class LocalCheckpointStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace("/", "_"))
+
+    def read(self, key):
+        try:
+            with open(self._path(key)) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        return record, record.get("_version")
+
+    def write(self, key, record, version):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with self._lock, open(f"{path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _, current = self.read(key)
+            if current != version:
+                return False
+            record = {**record, "_version": (version or 0) + 1}
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(record, f)
+            os.replace(f"{path}.tmp", path)
+        return True
+
+
+# Progress of one document run: the completed pages with the key and size of each page's output
+# object, and a lease per page range so a duplicate delivery of a message cannot work on a range
+# that a live invocation already owns. Every change is a read-modify-write retried on conflict.
+class DocumentCheckpoint:
+    def __init__(self, store, key, max_attempts=10, clock=time.time):
+        self.store = store
+        self.key = key
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.record = {"pages": {}, "leases": {}}
+
+    def refresh(self):
+        record, _ = self.store.read(self.key)
+        self.record = record or {"pages": {}, "leases": {}}
+        return self.record
+
+    # Apply change(record) and write the result; change returns the value handed back to the caller
+    def update(self, change):
+        for attempt in range(self.max_attempts):
+            record, version = self.store.read(self.key)
+            record = record or {"pages": {}, "leases": {}}
+            result = change(record)
+            if self.store.write(self.key, record, version):
+                self.record = record
+                return result
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        raise Exception(f"CheckpointConflict: could not update {self.key} after {self.max_attempts} attempts")
+
+    # Take the lease of a page range for ttl seconds. Returns False while another owner holds an
+    # unexpired lease; the same owner (a retry of the same invocation) may always take it again.
+    def acquire_lease(self, lease_key, owner, ttl):
+        now = self.clock()
+
+        def change(record):
+            lease = record["leases"].get(lease_key)
+            if lease and lease["owner"] != owner and lease["expires"] > now:
+                return False
+            record["leases"][lease_key] = {"owner": owner, "expires": now + ttl}
+            return True
+        return self.update(change)
+
+    def release_lease(self, lease_key, owner):
+        def change(record):
+            if record["leases"].get(lease_key, {}).get("owner") == owner:
+                del record["leases"][lease_key]
+        self.update(change)
+
+    def mark_page_done(self, page_num, part_key, size):
+        def change(record):
+            record["pages"][str(page_num)] = {"key": part_key, "size": size}
+        self.update(change)
+
+    # Record that the metrics events of the invocation that started at page start and stopped before
+    # page end are stored. Returns True for exactly one caller: the one whose record completes the
+    # coverage of [0, total_pages), which then writes the run summary.
+    def mark_metrics_written(self, start, end, total_pages):
+        def change(record):
+            ranges = record.setdefault("metrics", [])
+            ranges.append([start, end])
+            if record.get("metrics_summarized") or not covers(ranges, total_pages):
+                return False
+            record["metrics_summarized"] = True
+            return True
+        return self.update(change)
+
+    def page(self, page_num):
+        return self.record["pages"].get(str(page_num))
+
+    # First page at or after start that has no output yet
+    def first_unfinished(self, start):
+        page_num = start
+        while str(page_num) in self.record["pages"]:
+            page_num += 1
+        return page_num
+
+    # Ordered output parts covering pages [0, total_pages), or None while pages are missing
+    def output_parts(self, total_pages):
+        parts = []
+        for page_num in range(total_pages):
+            page = self.page(page_num)
+            if page is None:
+                return None
+            parts.append({"key": page["key"], "start": page_num, "end": page_num + 1, "size": page["size"]})
+        return parts
+
+
+# Whether the [start, end) ranges together cover every page of [0, total_pages)
+def covers(ranges, total_pages):
+    covered = 0
+    for start, end in sorted(ranges):
+        if start > covered:
+            return False
+        covered = max(covered, end)
+    return covered >= total_pages
+
+
+# Build the checkpoint store configured through the environment.
+#   CHECKPOINT_STORE    s3 (default, records in the state bucket) or local
+#   CHECKPOINT_DIR      directory of the local store, default /tmp/pdf-checkpoints
+def checkpoint_store_from_env(s3_client, bucket):
+    if os.getenv("CHECKPOINT_STORE", "s3").lower() == "local":
+        return LocalCheckpointStore(os.getenv("CHECKPOINT_DIR", "/tmp/pdf-checkpoints"))
+    return S3CheckpointStore(s3_client, bucket)
@@ -0,0 +1,74 @@
+import os
+import re
+
+
+# Token budget for the text carried from one page into the prompt of the next
+CARRYOVER_TOKEN_BUDGET = int(os.getenv("CARRYOVER_TOKEN_BUDGET", "1500"))
+
+# Short trailing lines (page numbers, footers) allowed between the last table and the end of the page
+MAX_TRAILING_LINES = 3
+MAX_TRAILING_LINE_LENGTH = 80
+
+TABLE_SEPARATOR = re.compile(r"^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+
+
+# Rough token estimate for English text (about four characters per token)
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+# Keep the end of a text within the budget, starting at a word boundary
+def tail_within_budget(text, token_budget):
+    max_chars = token_budget * 4
+    if len(text) <= max_chars:
+        return text
+    tail = text[-max_chars:]
+    space = tail.find(" ")
+    return tail[space + 1:] if 0 <= space < 40 else tail
+
+
+# Locate the markdown table the text ends with (ignoring a few short footer lines after it).
+# Returns the table lines, or None when the text does not end with a table.
+def trailing_table(lines):
+    end = len(lines)
+    skipped = 0
+    while end > 0 and not lines[end - 1].lstrip().startswith("|"):
+        if skipped >= MAX_TRAILING_LINES or len(lines[end - 1]) > MAX_TRAILING_LINE_LENGTH:
+            return None
+        if lines[end - 1].strip():
+            skipped += 1
+        end -= 1
+    start = end
+    while start > 0 and lines[start - 1].lstrip().startswith("|"):
+        start -= 1
+    return lines[start:end] if end > start else None
+
+
+# Extract the part of the previous page that the next page may continue: the header and final rows
+# of a trailing markdown table, or else the last paragraph, capped at token_budget tokens
+def extract_carryover(text, token_budget=None):
+    token_budget = token_budget or CARRYOVER_TOKEN_BUDGET
+    text = text.rstrip()
+    if not text:
+        return ""
+
+    table = trailing_table(text.splitlines())
+    if table:
+        separator = next((i for i, line in enumerate(table) if TABLE_SEPARATOR.match(line.strip())), None)
+        header = table[:separator + 1] if separator is not None else table[:1]
+        rows = table[len(header):]
+        budget = token_budget - estimate_tokens("\n".join(header))
+        kept = []
+        for row in reversed(rows):
+            cost = estimate_tokens(row) + 1
+            if cost > budget:
+                break
+            kept.insert(0, row)
+            budget -= cost
+        if budget >= 0:
+            return "\n".join(header + kept)
+        # Even the header alone is over budget
+        return tail_within_budget("\n".join(table), token_budget)
+
+    last_paragraph = re.split(r"\n\s*\n", text)[-1]
+    return tail_within_budget(last_paragraph, token_budget)
@@ -3,13 +3,27 @@ import os
 import logging
 import boto3
 import fitz  # PyMuPDF library for PDF processing
-from PIL import Image
 import re
-import shutil
 import time
 import urllib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, ReadTimeoutError
+
+from image_prep import shrink_image
+from context_carryover import extract_carryover
+from bedrock_limiter import RETRYABLE_ERROR_CODES, BedrockRateLimiter
+from checkpoint import DocumentCheckpoint, checkpoint_store_from_env
+from metrics import MetricsRecorder, summarize_metrics
+from model_router import CLASSIFIER_MODEL_ID, COMPLEX_PAGE_MODEL_ID, MODEL_TIERING, escalation_reasons, select_page_model
+from page_render import iter_page_images
+from prompts import CLASSIFY_LAYOUT_PROMPT, split_layout_marker, system_blocks, transcription_prompt
+from table_detector import detect_table_boundaries
+from text_layer import is_simple_text_page, page_to_markdown, score_text_layer
+from transcription_cache import transcription_cache_from_env, transcription_cache_key
 
 
 # Configure logging
@@ -18,17 +32,72 @@ logging.basicConfig(level=logging.INFO)
 
 
 # Initialize S3 and SQS clients
-s3_client = boto3.client('s3')
+s3_client = boto3.client('s3', config=Config(max_pool_connections=32))
 sqs_client = boto3.client('sqs')
 queue_url = os.environ['SQS_QUEUE_URL']  # The SQS queue URL
 output_bucket = os.environ['OUTPUT_BUCKET']
 
-# Set custom timeout
-config = Config(connect_timeout=300, read_timeout=300)  # Increase timeouts as needed
+# Source PDFs above the threshold are downloaded as parallel ranged GETs
+s3_transfer_config = TransferConfig(
+    multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '16')) * 1024 * 1024,
+    multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', '16')) * 1024 * 1024,
+    max_concurrency=int(os.getenv('S3_MAX_CONCURRENCY', '16')),
+)
+
+# Bucket and prefix holding the per-invocation output parts and manifests of each document
+state_bucket = os.getenv('STATE_BUCKET', output_bucket)
+parts_prefix = os.getenv('PARTS_PREFIX', 'pdf-parts')
+
+# Per-run checkpoint records (completed pages and page-range leases), kept in the state bucket
+checkpoint_store = checkpoint_store_from_env(s3_client, state_bucket)
+
+# Documents with at least this many pages are split into page ranges processed in parallel
+fanout_min_pages = int(os.getenv('FANOUT_MIN_PAGES', '100'))
+fanout_range_pages = int(os.getenv('FANOUT_RANGE_PAGES', '50'))
+
+# Carried-over text larger than this is passed through S3 instead of inline in the SQS message
+sqs_inline_carryover_bytes = int(os.getenv('SQS_INLINE_CARRYOVER_BYTES', '65536'))
+
+# S3 multipart uploads require every part except the last to be at least 5 MiB
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+# Content-addressed cache of page transcriptions (disabled unless TRANSCRIPTION_CACHE is set)
+transcription_cache = transcription_cache_from_env(s3_client)
+
+# Number of pages transcribed concurrently (1 keeps the original page-by-page behaviour)
+page_concurrency = max(1, int(os.getenv('PAGE_CONCURRENCY', '1')))
+
+# Answer table boundary checks from the PDF geometry where possible before asking the model
+local_table_detection = os.getenv('LOCAL_TABLE_DETECTION', 'true').lower() == 'true'
+
+# Stream transcriptions with converse_stream, flushing the text of each page to a local partial
+# file as it is generated; long pages then no longer depend on a single 300 second read
+bedrock_streaming = os.getenv('BEDROCK_STREAMING', 'false').lower() == 'true'
+partial_output_dir = os.getenv('PARTIAL_OUTPUT_DIR', '/tmp/partial-pages')
+
+# A transcription cut off by maxTokens or an interrupted stream is continued from its partial
+# text at most this many times instead of being restarted
+max_continuations = int(os.getenv('MAX_CONTINUATIONS', '3'))
+
+# Emit born-digital pages with a clean text layer as markdown directly instead of transcribing the image
+text_layer_fast_path = os.getenv('TEXT_LAYER_FAST_PATH', 'true').lower() == 'true'
+
+# Set custom timeout and size the connection pool for the concurrent page workers. Botocore's own
+# retries are disabled so throttling reaches the shared rate limiter below.
+config = Config(connect_timeout=300, read_timeout=300, max_pool_connections=max(10, page_concurrency * 2), retries={'mode': 'standard', 'max_attempts': 1})  # Increase timeouts as needed
 
 # Initialize Bedrock Runtime client with a custom timeout configuration
 bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ['AWS_REGION'], config=config)
 
+# Per-invocation telemetry of every Bedrock, S3 and SQS call (CloudWatch EMF lines plus a summary)
+metrics = MetricsRecorder()
+
+# Client-side Bedrock quota shared by every model call of this execution environment
+bedrock_limiter = BedrockRateLimiter(
+    requests_per_second=float(os.getenv('BEDROCK_MAX_RPS', '2')),
+    tokens_per_minute=float(os.getenv('BEDROCK_MAX_TPM', '400000')),
+)
+
 # # Base inference parameters to use.
 inferenceConfig={"maxTokens": 4096, "temperature": 0.0, "topP": 0.45}
 
@@ -50,257 +119,270 @@ inferenceConfig={"maxTokens": 4096, "temperature": 0.0, "topP": 0.45}
 #         print(f"Error encountered: {str(e)}")
 #         raise Exception(f"ModelInvocationException: Failed during invoke_model.") from e
 
-def invoke_with_delay(model_id, messages, delay=10, max_retries=3):
+# Total size of the images attached to a request
+def message_image_bytes(messages):
+    return sum(len(content["image"]["source"]["bytes"]) for message in messages for content in message["content"] if "image" in content)
+
+# Invoke the model through the shared rate limiter. Throttling, unavailability and read timeouts
+# are retried with jittered exponential backoff, and each one lowers the allowed request rate.
+# The call is recorded as one metrics event under the given operation name.
+# system holds optional Converse system blocks (see prompts.system_blocks). With stream_to set
+# the call uses converse_stream and writes the generated text to that file as it arrives.
+def invoke_with_delay(model_id, messages, delay=10, max_retries=3, operation="bedrock.converse", system=None, stream_to=None):
     retries = 0
-    while retries < max_retries:
-        try:
-            response = bedrock_runtime.converse(
-                modelId=model_id,
-                inferenceConfig=inferenceConfig,
-                messages=messages
-            )
-            # Log token usage.
+    request = {"modelId": model_id, "inferenceConfig": inferenceConfig, "messages": messages}
+    if system:
+        request["system"] = system
+    with metrics.timed(operation, model_id=model_id, image_bytes=message_image_bytes(messages)) as event:
+        while True:
+            estimate = bedrock_limiter.acquire()
+            try:
+                if stream_to is not None:
+                    response = read_converse_stream(bedrock_runtime.converse_stream(**request), stream_to)
+                else:
+                    response = bedrock_runtime.converse(**request)
+            except (ClientError, ReadTimeoutError) as e:
+                bedrock_limiter.record_usage(estimate, 0)
+                error_code = e.response['Error']['Code'] if isinstance(e, ClientError) else 'ReadTimeoutError'
+                if error_code not in RETRYABLE_ERROR_CODES and error_code != 'ReadTimeoutError':
+                    # logger.error(f"Error encountered: {str(e)}")
+                    print(f"Error encountered: {str(e)}")
+                    raise Exception(f"ModelInvocationException: Failed during invoke_model: {str(e)}") from e
+                if retries >= max_retries:
+                    raise Exception(f"Max retries exceeded. Bedrock model failed to respond: {str(e)}") from e
+                wait = bedrock_limiter.on_throttle(retries, delay)
+                retries += 1
+                event["retries"] = retries
+                # logger.warning(f"{error_code} occurred. Retry {retries} of {max_retries}. Waiting {wait:.1f} seconds.")
+                print(f"{error_code} occurred. Retry {retries} of {max_retries}. Waiting {wait:.1f} seconds.")
+                time.sleep(wait)
+                continue
+
+            # Log token usage and settle the rate limiter reservation with the real cost. inputTokens
+            # only counts the uncached input; prompt cache reads and writes are reported separately.
             token_usage = response['usage']
+            cache_read = token_usage.get('cacheReadInputTokens', 0)
+            cache_write = token_usage.get('cacheWriteInputTokens', 0)
+            bedrock_limiter.record_usage(estimate, token_usage['inputTokens'] + cache_read + cache_write + token_usage['outputTokens'])
+            bedrock_limiter.on_success()
+            event.update(
+                retries=retries,
+                input_tokens=token_usage['inputTokens'],
+                output_tokens=token_usage['outputTokens'],
+                cache_read_input_tokens=cache_read,
+                cache_write_input_tokens=cache_write,
+                stop_reason=response['stopReason'],
+            )
             # logger.info("Input tokens: %s", token_usage['inputTokens'])
             # logger.info("Output tokens: %s", token_usage['outputTokens'])
             # logger.info("Total tokens: %s", token_usage['totalTokens'])
             # logger.info("Stop reason: %s", response['stopReason'])
             print(f"Input tokens: {token_usage['inputTokens']}")
             print(f"Output tokens: {token_usage['outputTokens']}")
+            print(f"Cache read input tokens: {cache_read}")
+            print(f"Cache write input tokens: {cache_write}")
             print(f"Total tokens: {token_usage['totalTokens']}")
             print(f"Stop reason: {response['stopReason']}")
             return response
-        except Exception as e:
-            # If it's a timeout error, retry after a delay
-            if isinstance(e, ReadTimeoutError):
-                retries += 1
-                # logger.warning(f"Timeout occurred. Retry {retries} of {max_retries}. Waiting {delay} seconds.")
-                print(f"Timeout occurred. Retry {retries} of {max_retries}. Waiting {delay} seconds.")
-                time.sleep(delay)
-                delay *= 2  # Exponential backoff
-            else:
-                # logger.error(f"Error encountered: {str(e)}")
-                print(f"Error encountered: {str(e)}")
-                raise Exception(f"ModelInvocationException: Failed during invoke_model.") from e
-    
-    raise Exception("Max retries exceeded. Bedrock model failed to respond.")
-
-# Resize and reduce image size progressively if an error occurs
-def resize_image_by_scale(image_path, reduce_by=0.9):
-    img = Image.open(image_path)
-    width, height = img.size
-    new_width = int(width * reduce_by)
-    new_height = int(height * reduce_by)
-    img = img.resize((new_width, new_height), Image.LANCZOS)
-    img.save(image_path)
-    return img
-
-# Function to handle model invocation with error handling and resizing logic
-def invoke_model_with_resizing(image_path, messages, model_id, max_retries=5):
+
+# Consume a converse_stream response, writing text deltas to partial_file as they arrive. Returns
+# a dict shaped like a converse response. A stream that breaks off midway keeps the text received
+# so far and reports the stop reason "interrupted" so the caller can continue from it.
+def read_converse_stream(response, partial_file):
+    chunks = []
+    stop_reason = None
+    usage = {"inputTokens": 0, "outputTokens": 0, "totalTokens": 0}
+    try:
+        for stream_event in response["stream"]:
+            if "contentBlockDelta" in stream_event:
+                chunk = stream_event["contentBlockDelta"]["delta"].get("text", "")
+                chunks.append(chunk)
+                partial_file.write(chunk)
+                partial_file.flush()
+            elif "messageStop" in stream_event:
+                stop_reason = stream_event["messageStop"]["stopReason"]
+            elif "metadata" in stream_event:
+                usage = stream_event["metadata"]["usage"]
+    except (ClientError, BotoCoreError) as e:
+        print(f"Stream interrupted after {sum(len(chunk) for chunk in chunks)} characters: {str(e)}")
+        stop_reason = "interrupted"
+    return {
+        "output": {"message": {"role": "assistant", "content": [{"text": "".join(chunks)}]}},
+        "usage": usage,
+        "stopReason": stop_reason or "interrupted",
+    }
+
+# Transcribe with continuation: when the output stops at maxTokens or the stream breaks off, the
+# text so far is sent back as a prefilled assistant turn and the model picks up where it left off.
+# Returns a converse-shaped response holding the combined text.
+def converse_with_continuation(model_id, messages, system=None, partial_path=None):
+    text = ""
+    partial_file = None
+    if bedrock_streaming and partial_path:
+        os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+        partial_file = open(partial_path, "w")
+    try:
+        for continuation in range(max_continuations + 1):
+            request_messages = messages
+            if text:
+                # Trailing whitespace is not allowed at the end of a prefilled assistant turn
+                text = text.rstrip()
+                request_messages = messages + [{"role": "assistant", "content": [{"text": text}]}]
+            response = invoke_with_delay(
+                model_id, request_messages, system=system, stream_to=partial_file,
+                operation="bedrock.transcribe" if continuation == 0 else "bedrock.transcribe_continuation",
+            )
+            text += response["output"]["message"]["content"][0]["text"]
+            if response["stopReason"] not in ("max_tokens", "interrupted"):
+                break
+            print(f"Transcription stopped with {response['stopReason']} after {len(text)} characters, continuing")
+    finally:
+        if partial_file is not None:
+            partial_file.close()
+    if partial_file is not None:
+        os.remove(partial_path)
+    return {"output": {"message": {"role": "assistant", "content": [{"text": text}]}}, "stopReason": response["stopReason"]}
+
+# Converse content block for a prepared page image
+def image_block(image):
+    return {"image": {"format": image["format"], "source": {"bytes": image["bytes"]}}}
+
+# Function to handle model invocation with error handling. Images are sized for the model up front
+# by prepare_image; if the model still rejects one, the request is rebuilt once from a re-prepared,
+# smaller in-memory image instead of shrinking by 10% and resending the same bytes.
+def invoke_model_with_resizing(image, messages, model_id, max_retries=2, system=None, partial_path=None):
     retries = 0
     while retries < max_retries:
         try:
-            response = invoke_with_delay(model_id, messages)
+            response = converse_with_continuation(model_id, messages, system=system, partial_path=partial_path)
             return response
         except Exception as e:
             if "image exceeds" in str(e) or "Image exceeds max pixels allowed" in str(e):
-                # logger.warning(f"Image size issue detected on retry {retries + 1}. Resizing image: {image_path}")
-                print(f"Image size issue detected on retry {retries + 1}. Resizing image: {image_path}")
-                resize_image_by_scale(image_path)
+                # logger.warning(f"Image size issue detected on retry {retries + 1}. Resizing image.")
+                print(f"Image size issue detected on retry {retries + 1}. Resizing image from {image['width']}x{image['height']}.")
+                image = shrink_image(image, model_id)
+                metrics.record({"operation": "image.resize", "resize_attempts": 1, "image_bytes": len(image["bytes"])})
+                messages = [
+                    {**message, "content": [image_block(image) if "image" in content else content for content in message["content"]]}
+                    for message in messages
+                ]
             else:
                 raise e
         retries += 1
-    raise Exception(f"Max retries exceeded for image {image_path}")
-
-# Resize the image to ensure it fits within the allowed pixel limits when converting PDF to PNG
-def resize_image_initial(image_path, max_width=1024, max_height=1024):
-    img = Image.open(image_path)
-    width, height = img.size
-    aspect_ratio = width / height
-    if width > max_width or height > max_height:
-        if width > height:
-            new_width = max_width
-            new_height = int(new_width / aspect_ratio)
-        else:
-            new_height = max_height
-            new_width = int(new_height * aspect_ratio)
-        img = img.resize((new_width, new_height), Image.LANCZOS)
-        img.save(image_path)
-    return img
-
-# Convert PDF to PNG and resize the image to fit within the pixel limit
-def pdf_to_png(pdf_file, output_folder, dpi=150, max_width=1024, max_height=1024):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    pdf_document = fitz.open(pdf_file)
-    for page_num in range(len(pdf_document)):
+    raise Exception("Max retries exceeded for page image")
+
+# Text layer score of a page (see text_layer.score_text_layer), computed once per page; the ruled
+# tables found for it are kept in page_tables for the local table detector
+def page_text_score(pdf_document, page_num, page_scores=None, page_tables=None):
+    if page_scores is not None and page_num in page_scores:
+        return page_scores[page_num]
+    score = score_text_layer(pdf_document.load_page(page_num), page_tables)
+    if page_scores is not None:
+        page_scores[page_num] = score
+    return score
+
+# Route a page: return its markdown when the embedded text layer is clean enough to skip the
+# vision model, or None when the page has to be transcribed from its image
+def fast_path_markdown(pdf_document, page_num, page_scores=None, page_tables=None):
+    if not text_layer_fast_path:
+        return None
+    with metrics.timed("page.route", page=page_num + 1) as event:
         page = pdf_document.load_page(page_num)
-        zoom_matrix = fitz.Matrix(dpi / 72, dpi / 72)
-        pix = page.get_pixmap(matrix=zoom_matrix, alpha=False)
-        image_path = os.path.join(output_folder, f"page_{page_num+1}.png")
-        pix.save(image_path)
-        resize_image_initial(image_path, max_width=max_width, max_height=max_height)
-    pdf_document.close()
-
-# Function to extract page number from filename
-def extract_page_number(filename):
-    match = re.search(r"page_(\d+)\.png", filename)
-    if match:
-        return int(match.group(1))
-    return float('inf')
-
-# Check if the last element is a table (on previous page)
-def check_if_last_element_is_table(image_path):
-    with open(image_path, "rb") as f:
-        image = f.read()
+        score = page_text_score(pdf_document, page_num, page_scores, page_tables)
+        if not is_simple_text_page(score):
+            event["route"] = "model"
+            print(f"Page {page_num + 1} routed to model path: {score}")
+            return None
+        event["route"] = "fast_path"
+        print(f"Page {page_num + 1} routed to text layer fast path: {score}")
+        return page_to_markdown(page)
+
+# Classify whether a page starts and/or ends with a table in a single model call
+def classify_page_layout(image):
     messages = [
-        {"role": "user", "content": [{"image": {"format": "png", "source": {"bytes": image}}}, {"text": """Check the last visible content on this page and 
-        confirm if the last element (before any page footer) is a table. Answer 'Yes' if it is, 'No' otherwise."""}]}
+        {"role": "user", "content": [image_block(image), {"text": CLASSIFY_LAYOUT_PROMPT}]}
     ]
-    response = invoke_with_delay(model_id="anthropic.claude-3-sonnet-20240229-v1:0", messages=messages)
-    return "Yes" in response["output"]["message"]["content"][0]["text"]
-
-# Check if the first element is a table (on the current page)
-def check_if_first_element_is_table(image_path):
-    with open(image_path, "rb") as f:
-        image = f.read()
-    messages = [
-        {"role": "user", "content": [{"image": {"format": "png", "source": {"bytes": image}}}, {"text": """Check the first visible content on this page and 
-        confirm if the first element (after any page header) is a table. Answer 'Yes' if it is, 'No' otherwise."""}]}
-    ]
-    response = invoke_with_delay(model_id="anthropic.claude-3-sonnet-20240229-v1:0", messages=messages)
-    return "Yes" in response["output"]["message"]["content"][0]["text"]
-
-# Process the page using Bedrock model
-def process_subsequent_pages(previous_text, image_path, include_previous, model_id):
-    with open(image_path, "rb") as f:
-        image = f.read()
-    if include_previous:
-        user_message = f"""
-Transcribe the text content from the provided image page and output in Markdown syntax (not code blocks). 
-The text from the previous page is provided for reference. Follow these steps:
-
-1. Examine the provided page carefully, using the provided text from the previous page as reference for continuing any incomplete elements (e.g., tables or paragraphs).
-
-2. Identify all elements present in the page, including headers, body text, footnotes, tables, visualizations, captions, and page numbers, etc.
-
-3. Use markdown syntax to format your output:
-    - Headings: # for main, ## for sections, ### for subsections, etc.
-    - Lists: * or - for bulleted, 1. 2. 3. for numbered
-    - Do not repeat yourself
-
-4. If the element is a visualization
-    - Provide a detailed description in natural language
-    - Do not transcribe text in the visualization after providing the description
-
-5. If the element is a table or table of contents
-    - Create a markdown table, ensuring every row has the same number of columns
-    - Maintain cell alignment as closely as possible
-    - Do not split a table into multiple tables
-    - If a merged cell spans multiple rows or columns, place the text in the top-left cell and output ' ' for other cells.
-    - Use | for column separators, |-|-| for header row separators
-    - If a cell has multiple items, list them in separate rows
-    - If the table contains sub-headers, separate the sub-headers from the headers in another row
-
-6. If the element is a paragraph
-    - Transcribe each text element verbatim as it appears, without skipping any word.
-
-7. If the element is a header, footer, footnote, page number
-    - Transcribe each text element verbatim as it appears, without skipping any word.
-
-Output Example:
-
-A bar chart showing annual sales figures, with the y-axis labeled "Sales ($Million)" and the x-axis labeled "Year". The chart has bars for 2018 ($12M), 2019 ($18M), 2020 ($8M), and 2021 ($22M).
-Figure 3: This chart shows annual sales in millions. The year 2020 was significantly down due to the COVID-19 pandemic.
-
-# Annual Report
-
-## Financial Highlights
-
-* Revenue: $40M
-* Profit: $12M
-* EPS: $1.25
-
-
-| | Year Ended December 31, | |
-| | 2021 | 2022 |
-|-|-|-|
-| Cash provided by (used in): | | |
-| Operating activities | $ 46,327 | $ 46,752 |
-| Investing activities | (58,154) | (37,601) |
-| Financing activities | 6,291 | 9,718 |
+    response = invoke_with_delay(model_id=CLASSIFIER_MODEL_ID, messages=messages, operation="bedrock.classify_layout")
+    answer = response["output"]["message"]["content"][0]["text"]
+    first = re.search(r"First\W*(yes|no)", answer, re.IGNORECASE)
+    last = re.search(r"Last\W*(yes|no)", answer, re.IGNORECASE)
+    return {
+        "starts_with_table": bool(first) and first.group(1).lower() == "yes",
+        "ends_with_table": bool(last) and last.group(1).lower() == "yes",
+    }
 
+# Merge layout flags into the per-page cache without overwriting flags that are already known
+def record_page_layout(page_layouts, idx, layout):
+    known = page_layouts.setdefault(idx, {})
+    for flag, value in layout.items():
+        if value is not None and known.get(flag) is None:
+            known[flag] = value
+
+# Return one layout flag of a page, classifying the page only if neither the local detector nor
+# an earlier model call already answered it
+def get_page_layout_flag(page_layouts, idx, image, flag):
+    value = page_layouts.get(idx, {}).get(flag)
+    if value is None:
+        record_page_layout(page_layouts, idx, classify_page_layout(image))
+        value = page_layouts[idx][flag]
+    return value
+
+# Seed the layout cache from the PDF geometry; uncertain flags are left for the model
+def detect_page_layout(pdf_document, page_layouts, idx, page_tables=None):
+    if not local_table_detection or idx in page_layouts:
+        return
+    layout = detect_table_boundaries(pdf_document.load_page(idx), table_cache=page_tables)
+    print(f"Page {idx + 1} local table detection: {layout}")
+    record_page_layout(page_layouts, idx, layout)
 
-Here is the text from the previous page for reference to continue any incomplete elements (e.g., tables or paragraphs) :
+# Check if the last element is a table (on previous page)
+def check_if_last_element_is_table(image):
+    return classify_page_layout(image)["ends_with_table"]
 
-{previous_text}
+# Check if the first element is a table (on the current page)
+def check_if_first_element_is_table(image):
+    return classify_page_layout(image)["starts_with_table"]
 
-And here is the image of the next page.
-"""
+# Process the page using Bedrock model, returning the transcription and the layout it reported
+def process_subsequent_pages(previous_text, image, include_previous, model_id, page_num=None):
+    if include_previous:
+        # Only the trailing incomplete element (table header and last rows, or last paragraph) is carried
+        system_prompt, user_message = transcription_prompt(extract_carryover(previous_text))
     else:
-        user_message = """Transcribe the text content from an image page and output in Markdown syntax (not code blocks). Follow these steps:
-
-1. Examine the provided page carefully.
-
-2. Identify all elements present in the page, including headers, body text, footnotes, tables, visualizations, captions, and page numbers, etc.
-
-3. Use markdown syntax to format your output:
-    - Headings: # for main, ## for sections, ### for subsections, etc.
-    - Lists: * or - for bulleted, 1. 2. 3. for numbered
-    - Do not repeat yourself
-
-4. If the element is a visualization
-    - Provide a detailed description in natural language
-    - Do not transcribe text in the visualization after providing the description
-
-5. If the element is a table or table of contents
-    - Create a markdown table, ensuring every row has the same number of columns
-    - Maintain cell alignment as closely as possible
-    - Do not split a table into multiple tables
-    - If a merged cell spans multiple rows or columns, place the text in the top-left cell and output ' ' for other cells
-    - Use | for column separators, |-|-| for header row separators
-    - If a cell has multiple items, list them in separate rows
-    - If the table contains sub-headers, separate the sub-headers from the headers in another row
-
-6. If the element is a paragraph
-    - Transcribe each text element verbatim  as it appears, without skipping any word.
-
-7. If the element is a header, footer, footnote, page number
-    - Transcribe each text element verbatim as it appears, without skipping any word.
-
-Output Example:
-
-A bar chart showing annual sales figures, with the y-axis labeled "Sales ($Million)" and the x-axis labeled "Year". The chart has bars for 2018 ($12M), 2019 ($18M), 2020 ($8M), and 2021 ($22M).
-Figure 3: This chart shows annual sales in millions. The year 2020 was significantly down due to the COVID-19 pandemic.
-
-# Annual Report
-
-## Financial Highlights
-
-* Revenue: $40M
-* Profit: $12M
-* EPS: $1.25
-
-
-| | Year Ended December 31, | |
-| | 2021 | 2022 |
-|-|-|-|
-| Cash provided by (used in): | | |
-| Operating activities | $ 46,327 | $ 46,752 |
-| Investing activities | (58,154) | (37,601) |
-| Financing activities | 6,291 | 9,718 |
-
-Here is the image.
-"""
-    messages = [{"role": "user", "content": [{"image": {"format": "png", "source": {"bytes": image}}}, {"text": user_message}]}]
-    response = invoke_model_with_resizing(image_path, messages, model_id)
-    return response["output"]["message"]["content"][0]["text"]
+        system_prompt, user_message = transcription_prompt()
+    # Identical page, prompt, model and parameters always produce the same key, so repeated
+    # boilerplate pages and unchanged pages of re-uploaded documents skip the model call
+    if transcription_cache is not None:
+        cache_key = transcription_cache_key(image["bytes"], f"{system_prompt}\n{user_message}", model_id, inferenceConfig)
+        with metrics.timed("cache.get") as event:
+            cached_text = transcription_cache.get(cache_key)
+            event["hit"] = cached_text is not None
+        if cached_text is not None:
+            print(f"Transcription cache hit: {cache_key}")
+            return split_layout_marker(cached_text)
+
+    messages = [{"role": "user", "content": [image_block(image), {"text": user_message}]}]
+    partial_path = os.path.join(partial_output_dir, f"page-{page_num:06d}.md") if page_num is not None else None
+    response = invoke_model_with_resizing(image, messages, model_id, system=system_blocks(system_prompt, model_id), partial_path=partial_path)
+    content_text = response["output"]["message"]["content"][0]["text"]
+    # A transcription still cut off after max_continuations is kept for this run but never cached,
+    # so a later run of the page transcribes it again instead of reusing the truncated text
+    if response["stopReason"] not in ("end_turn", "stop_sequence"):
+        metrics.record({"operation": "page.incomplete", "stop_reason": response["stopReason"]})
+        print(f"Transcription still stopped with {response['stopReason']} after {max_continuations} continuations, not caching it")
+    elif transcription_cache is not None:
+        with metrics.timed("cache.put"):
+            transcription_cache.put(cache_key, content_text)
+    return split_layout_marker(content_text)
 
 # Handle SQS message re-triggering the lambda
 # def handle_sqs_trigger(event):
 #     body = json.loads(event['Records'][0]['body'])
 #     return body['page_counter'], body['previous_text'], body['source_bucket'], body['source_key'], body['s3_output_key']  # Extract s3_output_key
 
+# Returns the job carried by the SQS message. page_end bounds a fan-out page range (None means
+# the rest of the document) and run_id scopes the output parts to one processing run. Carried-over
+# text that was too large for the message is fetched from S3.
 def handle_sqs_trigger(event):
     # Extract and decode the SQS body from the event
     try:
@@ -308,95 +390,326 @@ def handle_sqs_trigger(event):
         # Parse the JSON string inside the body
         body = json.loads(sqs_body)
         print(f"SQS body: {body}")
-        return body['page_counter'], body['previous_text'], body['source_bucket'], urllib.parse.unquote_plus(body['source_key']), urllib.parse.unquote_plus(body['s3_output_key'])
+        return {
+            'page_counter': body['page_counter'],
+            'page_end': body.get('page_end'),
+            'previous_text': load_carryover(body),
+            'source_bucket': body['source_bucket'],
+            'source_key': urllib.parse.unquote_plus(body['source_key']),
+            's3_output_key': urllib.parse.unquote_plus(body['s3_output_key']),
+            'run_id': body.get('run_id', ''),
+        }
     except KeyError as e:
         print(f"KeyError occurred while parsing SQS body: {str(e)}")
         raise ValueError("Invalid SQS message structure")
     except json.JSONDecodeError as e:
         print(f"JSON decode error: {str(e)}")
         raise ValueError("Failed to parse SQS message body")
-        
-# Send SQS message when the function is about to timeout
-def send_sqs_message(source_bucket, source_key, s3_output_key, page_counter, previous_text):
-    message_body = {
+
+# Build the SQS message body that (re)starts processing of a page range
+def sqs_message_body(source_bucket, source_key, s3_output_key, page_counter, previous_text, page_end=None, run_id=""):
+    return {
         "source_bucket": source_bucket,
         "source_key": source_key,
         "page_counter": page_counter,
+        "page_end": page_end,
         "previous_text": previous_text,
-        "s3_output_key": s3_output_key  # Add this to the SQS message
+        "s3_output_key": s3_output_key,  # Add this to the SQS message
+        "run_id": run_id,
     }
-    sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps(message_body))
 
-# Add the logic to append the contents of the Lambda's local output file to the existing S3 file:
-def append_to_s3_file(output_bucket, s3_output_key, local_file_path):
+# Read the carried-over text of an SQS message, inline or from the S3 object it points to
+def load_carryover(body):
+    if body.get('previous_text_key'):
+        with metrics.timed("s3.get_carryover"):
+            return s3_client.get_object(Bucket=state_bucket, Key=body['previous_text_key'])['Body'].read().decode('utf-8')
+    return body.get('previous_text', "")
+
+# Send SQS message when the function is about to timeout. Only the bounded carryover of the last
+# page travels with it, and it is stored in S3 when it would still bloat the message.
+def send_sqs_message(source_bucket, source_key, s3_output_key, page_counter, previous_text, page_end=None, run_id=""):
+    carryover = extract_carryover(previous_text)
+    message_body = sqs_message_body(source_bucket, source_key, s3_output_key, page_counter, carryover, page_end, run_id)
+    if len(carryover.encode('utf-8')) > sqs_inline_carryover_bytes:
+        carryover_key = f"{output_parts_prefix(s3_output_key, run_id)}carryover-{page_counter:06d}.txt"
+        with metrics.timed("s3.put_carryover"):
+            s3_client.put_object(Bucket=state_bucket, Key=carryover_key, Body=carryover.encode('utf-8'))
+        message_body["previous_text"] = ""
+        message_body["previous_text_key"] = carryover_key
+    with metrics.timed("sqs.send_message"):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps(message_body))
+
+# Check whether a document can be split between page idx - 1 and page idx without cutting a table
+# in two. Only a confident "no table" answer from the text layer or the local detector counts;
+# both read the ruled tables of a page from page_tables, so find_tables() runs once per page.
+def is_table_safe_boundary(pdf_document, idx, page_tables=None):
+    for page_num, flag in ((idx - 1, "ends_with_table"), (idx, "starts_with_table")):
+        page = pdf_document.load_page(page_num)
+        if text_layer_fast_path and is_simple_text_page(score_text_layer(page, page_tables)):
+            return True
+        if local_table_detection and detect_table_boundaries(page, table_cache=page_tables)[flag] is False:
+            return True
+    return False
+
+# Split a document of at least fanout_min_pages pages into ranges of about range_pages pages. Each
+# boundary is moved to the nearest table-safe page within a quarter range, so continuation tables
+# stay in one range. Smaller documents come back as a single range.
+def plan_page_ranges(pdf_file, range_pages=None):
+    range_pages = range_pages or fanout_range_pages
+    pdf_document = fitz.open(pdf_file)
     try:
-        # Check if the S3 file exists using list_objects_v2
-        response = s3_client.list_objects_v2(Bucket=output_bucket, Prefix=s3_output_key)
-        file_exists = any(obj['Key'] == s3_output_key for obj in response.get('Contents', []))
-
-        if file_exists:
-            print(f"S3 file {s3_output_key} exists. Appending content.")
-
-            # If the file exists, download it to a local path
-            s3_temp_path = f'/tmp/s3-{os.path.basename(s3_output_key)}'
-            s3_client.download_file(output_bucket, s3_output_key, s3_temp_path)
-            print(f"Downloaded existing S3 file to {s3_temp_path}")
-
-            # Append the local file content to the S3 file
-            with open(s3_temp_path, 'a') as s3_file, open(local_file_path, 'r') as local_file:
-                s3_file.write(local_file.read())
-            print(f"Appended local content to the existing S3 file {s3_output_key}")
-
-            # Upload the updated file back to S3
-            s3_client.upload_file(s3_temp_path, output_bucket, s3_output_key)
-            print(f"Uploaded updated file to S3: {s3_output_key}")
-        else:
-            print(f"S3 file {s3_output_key} does not exist. Uploading as new file.")
-
-            # If the file doesn't exist, upload the local file as the S3 object
-            s3_client.upload_file(local_file_path, output_bucket, s3_output_key)
-            print(f"Uploaded new file to S3: {s3_output_key}")
-
-    except Exception as e:
-        print(f"Error appending or uploading to S3 file: {str(e)}")
-        raise
-
-# Main function to process the PDF and write to a single text file (with SQS for progress tracking)
-def process_pdf(pdf_file, output_file_path, source_bucket, source_key, s3_output_key, page_counter=0, previous_text="", context=None):
-    
-    # Use the Lambda's unique request ID to ensure a unique output folder for each invocation
-    output_folder = f'/tmp/png-output-{context.aws_request_id}/'
-    logger.info("pdf to png initial start")
-    pdf_to_png(pdf_file, output_folder)
-    logger.info("pdf to png initial end" )
-
-    # Get PNG files in the folder
-    png_files = [os.path.join(output_folder, filename) for filename in os.listdir(output_folder) if filename.endswith(".png")]
-    png_files = sorted(png_files, key=extract_page_number)
-
-    with open(output_file_path, "a") as output_file:
-        for idx in range(page_counter, len(png_files)):
-            print(f"Page counter : {idx+1}")
-            is_table_previous = check_if_last_element_is_table(png_files[idx - 1]) if idx > 0 else False
-            is_table_current = check_if_first_element_is_table(png_files[idx])
-            include_previous = is_table_previous and is_table_current
-            content_text = process_subsequent_pages(previous_text, png_files[idx], include_previous, "anthropic.claude-3-sonnet-20240229-v1:0")
-            previous_text = content_text
-            # Log the values of is_table_previous, is_table_current, and include_previous
-            print(f"is_table_previous: {is_table_previous}, is_table_current: {is_table_current}, include_previous: {include_previous}")
-
-            output_file.write(f"Page {idx + 1}\n{content_text}\n\n")
-            
-            
-            # Check Lambda remaining time
-            remaining_time = context.get_remaining_time_in_millis()
-            if remaining_time < 120000:  # If less than 2 mins remaining
-                print(f"Sending to SQS queue with values :: S3 bucket {source_bucket}, source_key {source_key}, s3_output_key {s3_output_key}, idx + 1 {idx + 1}, previous_text {previous_text}")
-                send_sqs_message(source_bucket, source_key, s3_output_key, idx + 1, previous_text)  # Send progress to SQS
-                break
+        total_pages = len(pdf_document)
+        if total_pages < fanout_min_pages:
+            return [(0, total_pages)], total_pages
+        boundaries = [0]
+        page_tables = {}
+        target = range_pages
+        search = max(1, range_pages // 4)
+        while target < total_pages:
+            candidates = sorted(range(max(boundaries[-1] + 1, target - search), min(total_pages, target + search + 1)), key=lambda idx: abs(idx - target))
+            boundary = next((idx for idx in candidates if is_table_safe_boundary(pdf_document, idx, page_tables)), None)
+            if boundary is None:
+                print(f"No table-safe boundary found near page {target + 1}, splitting there anyway")
+                boundary = target
+            boundaries.append(boundary)
+            target = boundary + range_pages
+        boundaries.append(total_pages)
+    finally:
+        pdf_document.close()
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])], total_pages
+
+# Fan a large document out as one SQS message per page range and record the plan next to its parts
+def enqueue_page_ranges(source_bucket, source_key, s3_output_key, run_id, ranges, total_pages):
+    plan = {'source_bucket': source_bucket, 'source_key': source_key, 's3_output_key': s3_output_key, 'total_pages': total_pages, 'ranges': ranges}
+    with metrics.timed("s3.put_plan"):
+        s3_client.put_object(Bucket=state_bucket, Key=f"{output_parts_prefix(s3_output_key, run_id)}plan.json", Body=json.dumps(plan, indent=4))
+    for batch_start in range(0, len(ranges), 10):  # SendMessageBatch takes at most 10 entries
+        entries = [
+            {'Id': str(batch_start + i), 'MessageBody': json.dumps(sqs_message_body(source_bucket, source_key, s3_output_key, start, "", end, run_id))}
+            for i, (start, end) in enumerate(ranges[batch_start:batch_start + 10])
+        ]
+        with metrics.timed("sqs.send_message_batch"):
+            response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        if response.get('Failed'):
+            raise Exception(f"Failed to enqueue page ranges: {response['Failed']}")
+    print(f"Enqueued {len(ranges)} page ranges for {source_key}: {ranges}")
+
+# Per-document prefix holding the independent page-range parts of an output file. The run ID keeps
+# parts of a re-uploaded document from mixing with those of an earlier run.
+def output_parts_prefix(s3_output_key, run_id=""):
+    return f"{parts_prefix}/{s3_output_key}/{run_id}/" if run_id else f"{parts_prefix}/{s3_output_key}/"
+
+# Checkpoint of one document run, stored next to its output parts
+def document_checkpoint(s3_output_key, run_id):
+    return DocumentCheckpoint(checkpoint_store, f"{output_parts_prefix(s3_output_key, run_id)}checkpoint.json")
+
+# Write one finished page as its own part object. The key only depends on the page, so a retried
+# invocation that redoes a page overwrites its part instead of adding a duplicate.
+def write_page_part(s3_output_key, run_id, page_num, content_text):
+    part_key = f"{output_parts_prefix(s3_output_key, run_id)}part-{page_num:06d}-{page_num + 1:06d}.txt"
+    body = f"Page {page_num + 1}\n{content_text}\n\n".encode("utf-8")
+    with metrics.timed("s3.upload_part_object", page=page_num + 1, object_bytes=len(body)):
+        s3_client.put_object(Bucket=state_bucket, Key=part_key, Body=body)
+    return part_key, len(body)
+
+# Read back the text of a finished page (used as the previous page text when resuming after it)
+def read_page_part(part_key):
+    with metrics.timed("s3.get_part_object") as event:
+        body = s3_client.get_object(Bucket=state_bucket, Key=part_key)['Body'].read().decode("utf-8")
+        event["object_bytes"] = len(body)
+    return body.split("\n", 1)[1].rstrip("\n") if "\n" in body else ""
+
+# Assemble the final output file from its parts without re-downloading large parts: parts of at
+# least 5 MiB are copied server side with UploadPartCopy, smaller neighbours are coalesced in
+# memory into one uploaded part. A manifest of the parts used is written next to them.
+def assemble_output_parts(s3_output_key, run_id, total_pages, checkpoint):
+    with metrics.timed("checkpoint.refresh"):
+        checkpoint.refresh()
+    parts = checkpoint.output_parts(total_pages)
+    if parts is None:
+        print(f"Output for {s3_output_key} is missing pages from {checkpoint.first_unfinished(0) + 1}")
+        return False
+    with metrics.timed("s3.assemble_output", object_bytes=sum(part['size'] for part in parts)):
+        combine_output_parts(s3_output_key, parts)
+
+    manifest = {'output_bucket': output_bucket, 's3_output_key': s3_output_key, 'total_pages': total_pages, 'parts': parts}
+    with metrics.timed("s3.put_manifest"):
+        s3_client.put_object(Bucket=state_bucket, Key=f"{output_parts_prefix(s3_output_key, run_id)}manifest.json", Body=json.dumps(manifest, indent=4))
+    print(f"Assembled {len(parts)} parts into s3://{output_bucket}/{s3_output_key}")
+    return True
+
+# Concatenate the selected parts into the final output object
+def combine_output_parts(s3_output_key, parts):
+    if sum(part['size'] for part in parts) < MIN_MULTIPART_PART_SIZE:
+        body = b"".join(s3_client.get_object(Bucket=state_bucket, Key=part['key'])['Body'].read() for part in parts)
+        s3_client.put_object(Bucket=output_bucket, Key=s3_output_key, Body=body)
+    else:
+        upload_id = s3_client.create_multipart_upload(Bucket=output_bucket, Key=s3_output_key)['UploadId']
+        try:
+            uploaded = []
+            buffer = b""
+
+            def flush(data):
+                response = s3_client.upload_part(Bucket=output_bucket, Key=s3_output_key, UploadId=upload_id, PartNumber=len(uploaded) + 1, Body=data)
+                uploaded.append({'PartNumber': len(uploaded) + 1, 'ETag': response['ETag']})
+
+            for part in parts:
+                if not buffer and part['size'] >= MIN_MULTIPART_PART_SIZE:
+                    response = s3_client.upload_part_copy(
+                        Bucket=output_bucket, Key=s3_output_key, UploadId=upload_id, PartNumber=len(uploaded) + 1,
+                        CopySource={'Bucket': state_bucket, 'Key': part['key']}
+                    )
+                    uploaded.append({'PartNumber': len(uploaded) + 1, 'ETag': response['CopyPartResult']['ETag']})
+                    continue
+                buffer += s3_client.get_object(Bucket=state_bucket, Key=part['key'])['Body'].read()
+                if len(buffer) >= MIN_MULTIPART_PART_SIZE:
+                    flush(buffer)
+                    buffer = b""
+            if buffer:
+                flush(buffer)
+            s3_client.complete_multipart_upload(Bucket=output_bucket, Key=s3_output_key, UploadId=upload_id, MultipartUpload={'Parts': uploaded})
+        except Exception:
+            s3_client.abort_multipart_upload(Bucket=output_bucket, Key=s3_output_key, UploadId=upload_id)
+            raise
 
-    shutil.rmtree(output_folder)
-    print(f"Processing completed. Output saved to : {output_file_path}")
+# Store the metrics events of this invocation next to its output part
+def write_metrics_part(s3_output_key, run_id, start, end):
+    metrics_key = f"{output_parts_prefix(s3_output_key, run_id)}metrics-{start:06d}-{end:06d}-{int(time.time() * 1000)}.json"
+    s3_client.put_object(Bucket=state_bucket, Key=metrics_key, Body=json.dumps(metrics.events))
+
+# Merge the metrics events of every invocation of a run into an end-of-document summary written
+# next to the .txt output. Only called once the checkpoint shows the metrics parts of all pages stored.
+def write_metrics_summary(s3_output_key, run_id):
+    events = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=state_bucket, Prefix=f"{output_parts_prefix(s3_output_key, run_id)}metrics-"):
+        for obj in page.get('Contents', []):
+            events.extend(json.loads(s3_client.get_object(Bucket=state_bucket, Key=obj['Key'])['Body'].read()))
+    summary = summarize_metrics(events)
+    summary_key = f"{s3_output_key}.metrics.json"
+    s3_client.put_object(Bucket=output_bucket, Key=summary_key, Body=json.dumps(summary, indent=4))
+    print(f"Metrics summary written to s3://{output_bucket}/{summary_key}: {json.dumps(summary['bedrock'])}")
+
+# Transcribe a single page. The previous page's text is only awaited when a table continues
+# across the page boundary, so pages without a dependency run fully in parallel.
+# Layouts from the local detector, earlier transcriptions or classifications are reused from
+# page_layouts, and the current page is only classified when the previous page ends with a table.
+# When the local detector left the previous page's ends_with_table open, its in-flight
+# transcription is awaited for the layout it reports instead of classifying it separately.
+def transcribe_page(idx, image, previous_image, previous_future, previous_text, page_layouts, score=None):
+    print(f"Page counter : {idx+1}")
+    with metrics.page(idx + 1):
+        if previous_future is not None and page_layouts.get(idx - 1, {}).get("ends_with_table") is None:
+            with metrics.timed("page.wait_previous_layout"):
+                previous_future.result()
+        is_table_previous = get_page_layout_flag(page_layouts, idx - 1, previous_image, "ends_with_table") if previous_image is not None else False
+        is_table_current = get_page_layout_flag(page_layouts, idx, image, "starts_with_table") if is_table_previous else False
+        include_previous = is_table_previous and is_table_current
+        # Log the values of is_table_previous, is_table_current, and include_previous
+        print(f"Page {idx + 1} is_table_previous: {is_table_previous}, is_table_current: {is_table_current}, include_previous: {include_previous}")
+        if include_previous and previous_future is not None:
+            previous_text = previous_future.result()
+
+        # Pages without complexity signals go to the cheaper model; continuing a table always
+        # needs the complex one
+        model_id, tier, signals = select_page_model(score, page_layouts.get(idx))
+        if include_previous and tier == "simple":
+            model_id, tier, signals = COMPLEX_PAGE_MODEL_ID, "complex", ["table_continuation"]
+        metrics.record({"operation": "page.model_route", "tier": tier, "target_model": model_id, "signals": ",".join(signals)})
+        print(f"Page {idx + 1} routed to {tier} model {model_id}: {signals}")
+        content_text, layout = process_subsequent_pages(previous_text, image, include_previous, model_id, page_num=idx)
+
+        # Redo simple page transcriptions that fail the quality check with the complex model
+        reasons = escalation_reasons(content_text, layout, score) if tier == "simple" else []
+        if reasons:
+            metrics.record({"operation": "page.escalate", "tier": "escalated", "target_model": COMPLEX_PAGE_MODEL_ID, "signals": ",".join(reasons)})
+            print(f"Page {idx + 1} escalated to {COMPLEX_PAGE_MODEL_ID}: {reasons}")
+            content_text, layout = process_subsequent_pages(previous_text, image, include_previous, COMPLEX_PAGE_MODEL_ID, page_num=idx)
+        if layout is not None:
+            record_page_layout(page_layouts, idx, layout)
+        return content_text
+
+# Main function to process the PDF. Returns the next page to process, the text of the last page
+# written, the end of the range and the document page count, so the caller can hand off to SQS.
+# With a checkpoint every page is stored and recorded as done as soon as it is written.
+def process_pdf(pdf_file, source_bucket, source_key, s3_output_key, page_counter=0, previous_text="", context=None, page_end=None, run_id="", checkpoint=None):
+    
+    pdf_document = fitz.open(pdf_file)
+    document_pages = len(pdf_document)
+    # A fan-out range worker stops at page_end; everything below treats it as the end of the document
+    total_pages = document_pages if page_end is None else min(page_end, document_pages)
+    if transcription_cache is not None:
+        transcription_cache.reset()
+
+    # Route each page before it is rendered; fast-path pages contain no tables, so their layout is known
+    fast_path_pages = {}
+    page_layouts = {}
+    page_scores = {}
+    page_tables = {}
+    def needs_image(page_num):
+        markdown = fast_path_markdown(pdf_document, page_num, page_scores, page_tables)
+        if markdown is None:
+            return True
+        fast_path_pages[page_num] = markdown
+        record_page_layout(page_layouts, page_num, {"starts_with_table": False, "ends_with_table": False})
+        return False
+
+    # Pages are rasterized lazily as they are submitted; a resumed invocation only renders the
+    # page before page_counter (for the table continuation check) and the pages it still has to do
+    page_images = iter_page_images(pdf_document, start=max(page_counter - 1, 0), needs_image=needs_image)
+    previous_image = next(page_images)[1] if 0 < page_counter <= total_pages else None
+    if previous_image is not None:
+        detect_page_layout(pdf_document, page_layouts, page_counter - 1, page_tables)
+
+    # Pages are submitted in order and at most page_concurrency of them are in flight at once.
+    # Every in-flight page owns a worker, so a page waiting on its predecessor can never starve it.
+    in_flight = deque()
+    route_counts = {"fast_path": 0, "model": 0}
+    previous_future = None
+    next_idx = page_counter
+    out_of_time = False
+    try:
+        with ThreadPoolExecutor(max_workers=page_concurrency) as executor:
+            while in_flight or (next_idx < total_pages and not out_of_time):
+                while not out_of_time and next_idx < total_pages and len(in_flight) < page_concurrency:
+                    _, image = next(page_images)
+                    if image is None:
+                        future = Future()
+                        future.set_result(fast_path_pages.pop(next_idx))
+                        route_counts["fast_path"] += 1
+                    else:
+                        detect_page_layout(pdf_document, page_layouts, next_idx, page_tables)
+                        route_counts["model"] += 1
+                        # The PDF is only read on this thread; workers get the page score for model routing
+                        score = page_text_score(pdf_document, next_idx, page_scores, page_tables) if MODEL_TIERING else None
+                        future = executor.submit(transcribe_page, next_idx, image, previous_image, previous_future, previous_text, page_layouts, score)
+                    in_flight.append((next_idx, future))
+                    previous_image = image
+                    previous_future = future
+                    next_idx += 1
+
+                # Write results strictly in page order
+                idx, future = in_flight.popleft()
+                content_text = future.result()
+                previous_text = content_text
+                # Store the page and record it as done, so no later invocation repeats it
+                if checkpoint is not None:
+                    part_key, part_size = write_page_part(s3_output_key, run_id, idx, content_text)
+                    with metrics.timed("checkpoint.mark_page_done", page=idx + 1):
+                        checkpoint.mark_page_done(idx, part_key, part_size)
+
+                # Check Lambda remaining time; stop submitting new pages and drain the in-flight window
+                remaining_time = context.get_remaining_time_in_millis()
+                if not out_of_time and next_idx < total_pages and remaining_time < 120000:  # If less than 2 mins remaining
+                    out_of_time = True
+    finally:
+        pdf_document.close()
+
+    print(f"Pages routed for {source_key}: fast path {route_counts['fast_path']}, model path {route_counts['model']}")
+    if transcription_cache is not None:
+        print(f"Transcription cache hits: {transcription_cache.hits}, misses: {transcription_cache.misses}")
+    print(f"Processing completed for pages {page_counter + 1}-{next_idx} of {source_key}")
+    return next_idx, previous_text, total_pages, document_pages
 
 # Lambda function handler
 def handler(event, context):
@@ -405,9 +718,12 @@ def handler(event, context):
     source_bucket = None
     source_key = None
     page_counter = 0
+    page_end = None
     previous_text = ""
     s3_output_key = ""
+    run_id = ""
     print(json.dumps(event, indent=4))
+    metrics.reset()
 
     
     # Handle SQS or S3 event
@@ -417,19 +733,18 @@ def handler(event, context):
         source_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
         page_counter, previous_text = 0, ""
         s3_output_key = f"{source_key}.txt"
+        # Async retries of the S3 event keep the request ID, so they continue the same run
+        run_id = context.aws_request_id
         print(f"S3 Event Trigger source_key :: {source_key}, s3_output_key {source_key}.txt")
         
     else:
         # SQS Event Trigger
         print(".....SQS event detected.....")
         try:
-            page_counter, previous_text, source_bucket, source_key, s3_output_key = handle_sqs_trigger(event)
-            print(f"Extracted from SQS: source_bucket: {source_bucket}, source_key: {source_key}, s3_output_key: {s3_output_key}")
-            
-            # Manually delete the SQS message after processing
-            receipt_handle = event['Records'][0]['receiptHandle']
-            sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
-            print(f"Deleted SQS message with ReceiptHandle: {receipt_handle}")
+            job = handle_sqs_trigger(event)
+            page_counter, page_end, previous_text = job['page_counter'], job['page_end'], job['previous_text']
+            source_bucket, source_key, s3_output_key, run_id = job['source_bucket'], job['source_key'], job['s3_output_key'], job['run_id']
+            print(f"Extracted from SQS: source_bucket: {source_bucket}, source_key: {source_key}, s3_output_key: {s3_output_key}, pages {page_counter + 1}-{page_end or 'end'}")
         except ValueError as e:
             print(f"Error processing SQS message: {str(e)}")
             raise
@@ -440,15 +755,64 @@ def handler(event, context):
         raise ValueError("Source key is missing or invalid")
     # Download the PDF file from S3
     pdf_file = f'/tmp/{os.path.basename(source_key)}'
-    s3_client.download_file(source_bucket, source_key, pdf_file)
-
-    # Output text file path
-    output_file_path = f'/tmp/output-text-file-{context.aws_request_id}.txt'
-    
-    # Process the PDF with progress tracking
-    process_pdf(pdf_file, output_file_path, source_bucket, source_key, s3_output_key, page_counter, previous_text, context)
-
-    # Append local output to the existing S3 output file and upload the updated file
-    append_to_s3_file(output_bucket, s3_output_key, output_file_path)
+    with metrics.timed("s3.download_file") as download_event:
+        s3_client.download_file(source_bucket, source_key, pdf_file, Config=s3_transfer_config)
+        download_event["object_bytes"] = os.path.getsize(pdf_file)
+
+    # Large new documents are split into page ranges that run in parallel instead of one SQS chain
+    if page_end is None and page_counter == 0:
+        ranges, total_pages = plan_page_ranges(pdf_file)
+        if len(ranges) > 1:
+            enqueue_page_ranges(source_bucket, source_key, s3_output_key, run_id, ranges, total_pages)
+            # Stored right after the ranges are sent, long before any of them can complete the summary
+            write_metrics_part(s3_output_key, run_id, 0, 0)
+            return {'statusCode': 200, 'body': json.dumps(f'Enqueued {len(ranges)} page ranges.')}
+
+    # Only one live invocation works on a page range at a time. A redelivered message that finds the
+    # lease taken fails, so SQS makes it visible again after the visibility timeout instead of
+    # deleting it: the lease of a crashed invocation runs out with its timeout, which is never later
+    # than that, and the next delivery takes the range over from the checkpoint.
+    checkpoint = document_checkpoint(s3_output_key, run_id)
+    lease_key = str(page_end) if page_end is not None else "end"
+    with metrics.timed("checkpoint.acquire_lease"):
+        acquired = checkpoint.acquire_lease(lease_key, context.aws_request_id, context.get_remaining_time_in_millis() / 1000)
+    if not acquired:
+        raise Exception(f"Pages {page_counter + 1}-{page_end or 'end'} of {source_key} are being processed by another invocation, retrying after the visibility timeout")
+
+    # Skip pages a previous attempt already finished, continuing from the text of the last one
+    range_start = page_counter
+    resume_page = checkpoint.first_unfinished(page_counter)
+    if resume_page > page_counter:
+        print(f"Pages {page_counter + 1}-{resume_page} already done, resuming at page {resume_page + 1}")
+        previous_text = read_page_part(checkpoint.page(resume_page - 1)['key'])
+        page_counter = resume_page
+
+    # Process the PDF with progress tracking; every finished page is stored and checkpointed
+    next_page, previous_text, range_end, total_pages = process_pdf(pdf_file, source_bucket, source_key, s3_output_key, page_counter, previous_text, context, page_end, run_id, checkpoint)
+    with metrics.timed("checkpoint.release_lease"):
+        checkpoint.release_lease(lease_key, context.aws_request_id)
+
+    if next_page < range_end:
+        print(f"Sending to SQS queue with values :: S3 bucket {source_bucket}, source_key {source_key}, s3_output_key {s3_output_key}, page_counter {next_page}, previous_text {len(previous_text)} characters")
+        send_sqs_message(source_bucket, source_key, s3_output_key, next_page, previous_text, page_end, run_id)  # Send progress to SQS
+    elif not assemble_output_parts(s3_output_key, run_id, total_pages, checkpoint):
+        # Every range checkpoints its pages before checking, so the last range to finish assembles the output
+        print(f"Pages {page_counter + 1}-{range_end} done, waiting for the remaining ranges of {source_key}")
+
+    # Store this invocation's metrics once all of its S3 and checkpoint work is done. The range is
+    # counted from the page its message started at, so pages of a crashed attempt stay covered. The
+    # invocation whose metrics complete the coverage of the document writes the run summary; it
+    # comes after the assembling worker, which records its metrics only after assembling.
+    write_metrics_part(s3_output_key, run_id, range_start, next_page)
+    if checkpoint.mark_metrics_written(range_start, next_page, total_pages):
+        write_metrics_summary(s3_output_key, run_id)
+
+    # Delete the SQS message only once its pages are stored and the next step is queued; a failed
+    # invocation leaves it to be redelivered and resumes from the checkpoint
+    if 'Records' in event and 'receiptHandle' in event['Records'][0]:
+        receipt_handle = event['Records'][0]['receiptHandle']
+        with metrics.timed("sqs.delete_message"):
+            sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
+        print(f"Deleted SQS message with ReceiptHandle: {receipt_handle}")
     
     return {'statusCode': 200, 'body': json.dumps('Processing completed successfully.')}
@@ -0,0 +1,81 @@
+import io
+import math
+import os
+
+from PIL import Image
+
+
+# Image limits per model family, matched by model ID prefix. max_bytes is the hard request
+# limit per image; max_long_edge / max_pixels is the size above which the model downscales the
+# image server side anyway, so sending more only costs bandwidth and latency.
+MODEL_IMAGE_LIMITS = {
+    "anthropic.claude-3": {"max_long_edge": 1568, "max_pixels": 1_150_000, "max_bytes": 3_750_000},
+    "us.anthropic.claude-3": {"max_long_edge": 1568, "max_pixels": 1_150_000, "max_bytes": 3_750_000},
+    "amazon.nova": {"max_long_edge": 8000, "max_pixels": 64_000_000, "max_bytes": 25_000_000},
+}
+DEFAULT_IMAGE_LIMITS = {"max_long_edge": 1568, "max_pixels": 1_150_000, "max_bytes": 3_750_000}
+
+# Lossy format tried for photographic content (jpeg or webp, both accepted by the Converse API)
+LOSSY_FORMAT = os.getenv("IMAGE_LOSSY_FORMAT", "jpeg").lower()
+LOSSY_QUALITY = int(os.getenv("IMAGE_LOSSY_QUALITY", "85"))
+
+# Images with at most this many distinct colours are text / line art and always stay PNG
+PALETTE_COLOURS = 256
+
+
+def image_limits(model_id):
+    for prefix, limits in MODEL_IMAGE_LIMITS.items():
+        if model_id.startswith(prefix):
+            return limits
+    return DEFAULT_IMAGE_LIMITS
+
+
+# Scale factor (<= 1) that brings an image of the given size within the pixel limits in one step
+def fit_scale(width, height, limits):
+    return min(1.0, limits["max_long_edge"] / max(width, height), math.sqrt(limits["max_pixels"] / (width * height)))
+
+
+def encode(img, image_format):
+    buffer = io.BytesIO()
+    if image_format == "png":
+        img.save(buffer, format="PNG", optimize=True)
+    else:
+        img.save(buffer, format=image_format.upper(), quality=LOSSY_QUALITY)
+    return buffer.getvalue()
+
+
+# Encode as PNG for text and line art; for photographic content also try the lossy format and
+# keep whichever is smaller
+def encode_cheapest(img):
+    candidates = {"png": encode(img, "png")}
+    if img.getcolors(maxcolors=PALETTE_COLOURS) is None:
+        candidates[LOSSY_FORMAT] = encode(img, LOSSY_FORMAT)
+    image_format = min(candidates, key=lambda name: len(candidates[name]))
+    return candidates[image_format], image_format
+
+
+# Prepare a PIL image for a model: compute the final dimensions from the model's pixel limits up
+# front, pick the cheaper encoding, and only if the result is still over the byte limit shrink once
+# more by the exact factor needed. Returns the image as {"bytes", "format", "width", "height"}.
+def prepare_image(img, model_id, pixel_budget=1.0):
+    limits = dict(image_limits(model_id))
+    limits["max_pixels"] = int(limits["max_pixels"] * pixel_budget)
+    img = img.convert("RGB")
+    scale = fit_scale(img.width, img.height, limits)
+    if scale < 1.0:
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+    data, image_format = encode_cheapest(img)
+    if len(data) > limits["max_bytes"]:
+        # Encoded size scales roughly with the pixel count
+        scale = math.sqrt(limits["max_bytes"] / len(data)) * 0.9
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+        data, image_format = encode_cheapest(img)
+    return {"bytes": data, "format": image_format, "width": img.width, "height": img.height}
+
+
+# Re-prepare an already encoded image with a smaller pixel budget (used when a model still rejects it)
+def shrink_image(image, model_id, pixel_budget=0.5):
+    img = Image.open(io.BytesIO(image["bytes"]))
+    limits = image_limits(model_id)
+    current_budget = min(1.0, img.width * img.height / limits["max_pixels"])
+    return prepare_image(img, model_id, pixel_budget=current_budget * pixel_budget)
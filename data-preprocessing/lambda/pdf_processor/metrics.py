@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Numeric fields emitted as CloudWatch metrics, with their units
+METRIC_UNITS = {
+    "wall_ms": "Milliseconds",
+    "input_tokens": "Count",
+    "output_tokens": "Count",
+    "cache_read_input_tokens": "Count",
+    "cache_write_input_tokens": "Count",
+    "retries": "Count",
+    "resize_attempts": "Count",
+    "image_bytes": "Bytes",
+    "object_bytes": "Bytes",
+}
+
+CSV_FIELDS = ["timestamp", "operation", "page", "model_id", "route", "error"] + list(METRIC_UNITS)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] if values else None
+
+
+# Collects one event per Bedrock, S3 and SQS call of a document run. Every event is printed as a
+# CloudWatch Embedded Metric Format line (and optionally appended to a CSV file) as it happens;
+# the raw events are kept so an end-of-document summary can be built from them.
+class MetricsRecorder:
+    def __init__(self, namespace=None, csv_path=None):
+        self.namespace = namespace or os.getenv("METRICS_NAMESPACE", "PdfProcessor")
+        self.csv_path = csv_path if csv_path is not None else os.getenv("METRICS_CSV_PATH")
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # Drop the events of the previous invocation of a warm execution environment
+    def reset(self):
+        with self._lock:
+            self.events = []
+
+    # Attribute every event recorded by the current thread to a page (1-based)
+    @contextmanager
+    def page(self, page_number):
+        previous = getattr(self._local, "page", None)
+        self._local.page = page_number
+        try:
+            yield
+        finally:
+            self._local.page = previous
+
+    # Time a block and record it as one event; the yielded dict can be filled with extra fields
+    @contextmanager
+    def timed(self, operation, **fields):
+        event = {"operation": operation, **fields}
+        start = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event["error"] = type(e).__name__
+            raise
+        finally:
+            event["wall_ms"] = (time.perf_counter() - start) * 1000
+            self.record(event)
+
+    def record(self, event):
+        event.setdefault("timestamp", int(time.time() * 1000))
+        event.setdefault("page", getattr(self._local, "page", None))
+        with self._lock:
+            self.events.append(event)
+            print(json.dumps(self.emf(event)))
+            if self.csv_path:
+                write_header = not os.path.exists(self.csv_path)
+                with open(self.csv_path, "a", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+                    if write_header:
+                        writer.writeheader()
+                    writer.writerow(event)
+
+    def emf(self, event):
+        dimensions = ["Operation"] + (["ModelId"] if event.get("model_id") else [])
+        metrics = [{"Name": name, "Unit": unit} for name, unit in METRIC_UNITS.items() if event.get(name) is not None]
+        line = {
+            "_aws": {
+                "Timestamp": event["timestamp"],
+                "CloudWatchMetrics": [{"Namespace": self.namespace, "Dimensions": [dimensions], "Metrics": metrics}],
+            },
+            "Operation": event["operation"],
+        }
+        if event.get("model_id"):
+            line["ModelId"] = event["model_id"]
+        line.update({key: value for key, value in event.items() if key not in ("operation", "model_id", "timestamp")})
+        return line
+
+
+def _aggregate(events):
+    wall = [event["wall_ms"] for event in events if event.get("wall_ms") is not None]
+    return {
+        "count": len(events),
+        "errors": sum(1 for event in events if event.get("error")),
+        "wall_ms_total": sum(wall),
+        "wall_ms_p50": percentile(wall, 50),
+        "wall_ms_p95": percentile(wall, 95),
+        "wall_ms_max": max(wall) if wall else None,
+        "input_tokens": sum(event.get("input_tokens") or 0 for event in events),
+        "output_tokens": sum(event.get("output_tokens") or 0 for event in events),
+        "cache_read_input_tokens": sum(event.get("cache_read_input_tokens") or 0 for event in events),
+        "cache_write_input_tokens": sum(event.get("cache_write_input_tokens") or 0 for event in events),
+        "retries": sum(event.get("retries") or 0 for event in events),
+        "resize_attempts": sum(event.get("resize_attempts") or 0 for event in events),
+        "image_bytes": sum(event.get("image_bytes") or 0 for event in events),
+    }
+
+
+# Summarize the events of a whole document (possibly gathered from several invocations)
+def summarize_metrics(events):
+    def group(key):
+        groups = {}
+        for event in events:
+            if event.get(key) is not None:
+                groups.setdefault(str(event[key]), []).append(event)
+        return {name: _aggregate(group_events) for name, group_events in sorted(groups.items())}
+
+    bedrock_events = [event for event in events if event["operation"].startswith("bedrock.")]
+    pages = {}
+    for event in bedrock_events:
+        if event.get("page") is not None:
+            pages.setdefault(event["page"], []).append(event)
+    page_totals = {page: _aggregate(page_events) for page, page_events in pages.items()}
+    slowest = sorted(page_totals.items(), key=lambda item: item[1]["wall_ms_total"], reverse=True)[:10]
+    return {
+        "events": len(events),
+        "total": _aggregate(events),
+        "bedrock": _aggregate(bedrock_events),
+        "by_operation": group("operation"),
+        "by_model": group("model_id"),
+        "by_route": group("route"),
+        "by_tier": group("tier"),
+        "page_wall_ms_mean": statistics.mean(totals["wall_ms_total"] for totals in page_totals.values()) if page_totals else None,
+        "slowest_pages": [{"page": page, **totals} for page, totals in slowest],
+    }
@@ -0,0 +1,88 @@
+import os
+import re
+
+
+SONNET_MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+HAIKU_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+
+# With tiering off every call goes to the complex page model, as before
+MODEL_TIERING = os.getenv("MODEL_TIERING", "true").lower() == "true"
+
+# Models for pages with complexity signals (and escalations), for the yes / no table boundary
+# checks, and for pages without complexity signals
+COMPLEX_PAGE_MODEL_ID = os.getenv("COMPLEX_PAGE_MODEL_ID", SONNET_MODEL_ID)
+CLASSIFIER_MODEL_ID = os.getenv("CLASSIFIER_MODEL_ID", HAIKU_MODEL_ID if MODEL_TIERING else COMPLEX_PAGE_MODEL_ID)
+SIMPLE_PAGE_MODEL_ID = os.getenv("SIMPLE_PAGE_MODEL_ID", HAIKU_MODEL_ID)
+
+# Pages beyond any of these limits are sent to the complex page model
+SIMPLE_MAX_CHARACTERS = int(os.getenv("SIMPLE_MAX_CHARACTERS", "3000"))
+SIMPLE_MAX_DRAWINGS = 20
+SIMPLE_MAX_IMAGE_RATIO = 0.2
+
+# A simple page transcription shorter than this share of the page's text layer is redone
+MIN_TEXT_RECALL = 0.6
+
+TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+
+
+# Reasons a page needs the complex page model, from its text layer score (see
+# text_layer.score_text_layer) and the table boundary flags known so far. A page without a
+# score (no usable text layer information) counts as complex.
+def complexity_signals(score, layout=None):
+    if score is None:
+        return ["no_score"]
+    signals = []
+    if score["tables"] is None or score["tables"] > 0:
+        signals.append("tables")
+    if layout and (layout.get("starts_with_table") or layout.get("ends_with_table")):
+        signals.append("table_boundary")
+    if score["drawings"] > SIMPLE_MAX_DRAWINGS:
+        signals.append("drawings")
+    if score["image_ratio"] > SIMPLE_MAX_IMAGE_RATIO:
+        signals.append("images")
+    if score["columnar"]:
+        signals.append("columnar")
+    if score["characters"] > SIMPLE_MAX_CHARACTERS:
+        signals.append("dense_text")
+    if score["characters"] == 0:
+        # Scanned page: nothing to judge the transcription against
+        signals.append("no_text_layer")
+    return signals
+
+
+# Pick the transcription model for a page; returns (model_id, tier, signals)
+def select_page_model(score, layout=None):
+    if not MODEL_TIERING:
+        return COMPLEX_PAGE_MODEL_ID, "complex", ["tiering_disabled"]
+    signals = complexity_signals(score, layout)
+    if signals:
+        return COMPLEX_PAGE_MODEL_ID, "complex", signals
+    return SIMPLE_PAGE_MODEL_ID, "simple", signals
+
+
+# Markdown tables whose rows do not all have the same number of columns
+def has_ragged_table(text):
+    widths = set()
+    for line in text.splitlines() + [""]:
+        if TABLE_ROW.match(line):
+            widths.add(line.strip().strip("|").count("|"))
+        else:
+            if len(widths) > 1:
+                return True
+            widths = set()
+    return False
+
+
+# Quality check of a simple page transcription; returns the reasons to redo it with the
+# complex page model (an empty list means the transcription is kept)
+def escalation_reasons(text, layout, score):
+    reasons = []
+    if not text.strip():
+        reasons.append("empty")
+    if layout is None:
+        reasons.append("missing_layout_marker")
+    if score is not None and score["characters"] and len(text) < score["characters"] * MIN_TEXT_RECALL:
+        reasons.append("low_recall")
+    if has_ragged_table(text):
+        reasons.append("ragged_table")
+    return reasons
@@ -0,0 +1,31 @@
+import fitz  # PyMuPDF library for PDF processing
+from PIL import Image
+
+from image_prep import prepare_image
+from model_router import COMPLEX_PAGE_MODEL_ID
+
+
+# Pick the zoom that renders the page straight into the pixel limit, so no resampling pass is needed
+def page_zoom(page, dpi=150, max_width=1024, max_height=1024):
+    rect = page.rect
+    return min(dpi / 72, max_width / rect.width, max_height / rect.height)
+
+
+# Rasterize a single page straight into memory and prepare it for the model (final size and the
+# cheaper of PNG / lossy encoding); returns {"bytes", "format", "width", "height"}
+def render_page(pdf_document, page_num, dpi=150, max_width=1024, max_height=1024, model_id=COMPLEX_PAGE_MODEL_ID):
+    page = pdf_document.load_page(page_num)
+    zoom = page_zoom(page, dpi=dpi, max_width=max_width, max_height=max_height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return prepare_image(Image.frombytes("RGB", (pix.width, pix.height), pix.samples), model_id)
+
+
+# Lazily rasterize pages [start, end) one at a time, right before they are needed.
+# Pages for which needs_image(page_num) is False are yielded with None and never rendered.
+def iter_page_images(pdf_document, start=0, end=None, needs_image=None, dpi=150, max_width=1024, max_height=1024):
+    end = len(pdf_document) if end is None else min(end, len(pdf_document))
+    for page_num in range(start, end):
+        if needs_image is not None and not needs_image(page_num):
+            yield page_num, None
+        else:
+            yield page_num, render_page(pdf_document, page_num, dpi=dpi, max_width=max_width, max_height=max_height)
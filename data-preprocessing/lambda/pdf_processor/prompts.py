@@ -0,0 +1,127 @@
+import re
+
+
+# Static transcription instructions, sent once per call as the system prompt. Everything that
+# varies per page (the image and the carried-over text) goes into the user message after it.
+TRANSCRIPTION_SYSTEM_PROMPT = """Transcribe the text content from the provided image page and output in Markdown syntax (not code blocks).
+When the text from the previous page is provided, use it for reference only. Follow these steps:
+
+1. Examine the provided page carefully, using the text from the previous page (if provided) as reference for continuing any incomplete elements (e.g., tables or paragraphs).
+
+2. Identify all elements present in the page, including headers, body text, footnotes, tables, visualizations, captions, and page numbers, etc.
+
+3. Use markdown syntax to format your output:
+    - Headings: # for main, ## for sections, ### for subsections, etc.
+    - Lists: * or - for bulleted, 1. 2. 3. for numbered
+    - Do not repeat yourself
+
+4. If the element is a visualization
+    - Provide a detailed description in natural language
+    - Do not transcribe text in the visualization after providing the description
+
+5. If the element is a table or table of contents
+    - Create a markdown table, ensuring every row has the same number of columns
+    - Maintain cell alignment as closely as possible
+    - Do not split a table into multiple tables
+    - If a merged cell spans multiple rows or columns, place the text in the top-left cell and output ' ' for other cells
+    - Use | for column separators, |-|-| for header row separators
+    - If a cell has multiple items, list them in separate rows
+    - If the table contains sub-headers, separate the sub-headers from the headers in another row
+
+6. If the element is a paragraph
+    - Transcribe each text element verbatim as it appears, without skipping any word.
+
+7. If the element is a header, footer, footnote, page number
+    - Transcribe each text element verbatim as it appears, without skipping any word.
+
+8. After the page content, add one final line reporting the page layout, exactly in this form:
+    <!-- layout: starts_with_table=Yes ends_with_table=No -->
+    - starts_with_table is Yes if the first element (after any page header) is a table, No otherwise
+    - ends_with_table is Yes if the last element (before any page footer) is a table, No otherwise
+
+Do not transcribe the text from the previous page itself, only the content of the page image.
+
+Output Example:
+
+A bar chart showing annual sales figures, with the y-axis labeled "Sales ($Million)" and the x-axis labeled "Year". The chart has bars for 2018 ($12M), 2019 ($18M), 2020 ($8M), and 2021 ($22M).
+Figure 3: This chart shows annual sales in millions. The year 2020 was significantly down due to the COVID-19 pandemic.
+
+# Annual Report
+
+## Financial Highlights
+
+* Revenue: $40M
+* Profit: $12M
+* EPS: $1.25
+
+
+| | Year Ended December 31, | |
+| | 2021 | 2022 |
+|-|-|-|
+| Cash provided by (used in): | | |
+| Operating activities | $ 46,327 | $ 46,752 |
+| Investing activities | (58,154) | (37,601) |
+| Financing activities | 6,291 | 9,718 |
+"""
+
+# Per-page user text that follows the page image
+FIRST_PAGE_PROMPT = "Here is the image."
+
+CONTINUATION_PROMPT = """Here is the text from the previous page for reference to continue any incomplete elements (e.g., tables or paragraphs) :
+
+{previous_text}
+
+And here is the image of the next page."""
+
+# Layout marker the transcription prompts ask the model to append after the page content
+LAYOUT_MARKER = re.compile(r"<!--\s*layout:\s*starts_with_table\s*=\s*(yes|no)\s+ends_with_table\s*=\s*(yes|no)\s*-->", re.IGNORECASE)
+
+CLASSIFY_LAYOUT_PROMPT = """Check the first and the last visible content on this page.
+The first element is the first content after any page header, the last element is the last content before any page footer.
+Answer with exactly two lines and nothing else:
+First: Yes or No (Yes if the first element is a table)
+Last: Yes or No (Yes if the last element is a table)"""
+
+# Model families that accept Converse cache points, matched by model ID after any cross-region
+# inference profile prefix (us., eu., apac.). Claude models only cache prompts of at least
+# 1,024 tokens (2,048 for Haiku); shorter prefixes are sent uncached without an error.
+PROMPT_CACHING_MODELS = (
+    "anthropic.claude-3-5-haiku",
+    "anthropic.claude-3-7-sonnet",
+    "anthropic.claude-sonnet-4",
+    "anthropic.claude-opus-4",
+    "amazon.nova",
+)
+
+REGION_PREFIX = re.compile(r"^(us|eu|apac|us-gov|global)\.")
+
+
+def supports_prompt_caching(model_id):
+    return REGION_PREFIX.sub("", model_id).startswith(PROMPT_CACHING_MODELS)
+
+
+# Converse system blocks for a static prompt, marked as a cache point where the model supports it
+def system_blocks(prompt, model_id):
+    blocks = [{"text": prompt}]
+    if supports_prompt_caching(model_id):
+        blocks.append({"cachePoint": {"type": "default"}})
+    return blocks
+
+
+# Return the (system prompt, user text) pair for transcribing a page
+def transcription_prompt(previous_text=None):
+    if previous_text is None:
+        return TRANSCRIPTION_SYSTEM_PROMPT, FIRST_PAGE_PROMPT
+    return TRANSCRIPTION_SYSTEM_PROMPT, CONTINUATION_PROMPT.format(previous_text=previous_text)
+
+
+# Split the layout marker off a transcription, returning the clean text and the reported layout (or None)
+def split_layout_marker(text):
+    match = LAYOUT_MARKER.search(text)
+    if not match:
+        return text, None
+    layout = {
+        "starts_with_table": match.group(1).lower() == "yes",
+        "ends_with_table": match.group(2).lower() == "yes",
+    }
+    return LAYOUT_MARKER.sub("", text).rstrip(), layout
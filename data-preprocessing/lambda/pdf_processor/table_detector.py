@@ -0,0 +1,89 @@
+import statistics
+
+import fitz  # PyMuPDF library for PDF processing
+
+
+# Fraction of the page height at the top and bottom treated as header / footer band
+HEADER_FOOTER_MARGIN = 0.08
+
+# Fraction of the page height inspected below the first (or above the last) content element
+# when looking for borderless, column-aligned text
+EDGE_REGION = 0.15
+
+# A word gap wider than this many line heights is treated as a column gap
+COLUMN_GAP_FACTOR = 2.5
+
+
+# Return the text blocks of a page that lie between the header and footer bands
+def content_blocks(page, margin=HEADER_FOOTER_MARGIN):
+    rect = page.rect
+    top = rect.y0 + rect.height * margin
+    bottom = rect.y1 - rect.height * margin
+    blocks = []
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+        if block_type != 0 or not text.strip():
+            continue
+        if y1 <= top or y0 >= bottom:
+            continue
+        blocks.append(fitz.Rect(x0, y0, x1, y1))
+    return blocks
+
+
+# Ruled tables found by PyMuPDF, or None when this PyMuPDF version has no table finder.
+# find_tables() is the most expensive local step on a page; with a cache dict (keyed by page
+# number, one per document) the text layer score and the boundary detector share one run.
+def ruled_tables(page, cache=None):
+    if cache is not None and page.number in cache:
+        return cache[page.number]
+    tables = [fitz.Rect(table.bbox) for table in page.find_tables().tables] if hasattr(page, "find_tables") else None
+    if cache is not None:
+        cache[page.number] = tables
+    return tables
+
+
+# Check whether a region contains at least two lines whose words are split by wide column gaps,
+# which is what a borderless table looks like to the ruled-line table finder
+def looks_columnar(page, clip):
+    lines = {}
+    for x0, y0, x1, y1, _, block_no, line_no, _ in page.get_text("words", clip=clip):
+        lines.setdefault((block_no, line_no), []).append((x0, x1, y1 - y0))
+    columnar_lines = 0
+    for words in lines.values():
+        if len(words) < 2:
+            continue
+        words.sort()
+        line_height = statistics.median(height for _, _, height in words)
+        gaps = [words[i + 1][0] - words[i][1] for i in range(len(words) - 1)]
+        if sum(1 for gap in gaps if gap > line_height * COLUMN_GAP_FACTOR) >= 1:
+            columnar_lines += 1
+    return columnar_lines >= 2
+
+
+# Decide locally whether a page starts and/or ends with a table.
+# Each flag is True / False when the page geometry is unambiguous and None when the caller
+# should ask the model instead (image-only pages, borderless tables near the edge, old PyMuPDF).
+def detect_table_boundaries(page, margin=HEADER_FOOTER_MARGIN, table_cache=None):
+    layout = {"starts_with_table": None, "ends_with_table": None}
+    tables = ruled_tables(page, table_cache)
+    blocks = content_blocks(page, margin)
+    if tables is None or not blocks:
+        return layout
+
+    def in_table(rect):
+        centre = fitz.Point((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+        return any(centre in table for table in tables)
+
+    # Tables and free text blocks ordered by position; text inside a table counts as the table
+    items = [(table, True) for table in tables]
+    items += [(block, False) for block in blocks if not in_table(block)]
+    first_rect, first_is_table = min(items, key=lambda item: item[0].y0)
+    last_rect, last_is_table = max(items, key=lambda item: item[0].y1)
+
+    region = page.rect.height * EDGE_REGION
+    layout["starts_with_table"] = first_is_table
+    layout["ends_with_table"] = last_is_table
+    if not first_is_table and looks_columnar(page, fitz.Rect(page.rect.x0, first_rect.y0, page.rect.x1, first_rect.y0 + region)):
+        layout["starts_with_table"] = None
+    if not last_is_table and looks_columnar(page, fitz.Rect(page.rect.x0, last_rect.y1 - region, page.rect.x1, last_rect.y1)):
+        layout["ends_with_table"] = None
+    return layout
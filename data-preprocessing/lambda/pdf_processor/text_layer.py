@@ -0,0 +1,118 @@
+import re
+import statistics
+
+import fitz  # PyMuPDF library for PDF processing
+
+from table_detector import looks_columnar, ruled_tables
+
+
+# Minimum share of the page content area (text + images + filled drawings) that must be text
+MIN_TEXT_COVERAGE = 0.9
+
+# Minimum share of extracted characters that must be sane glyphs (not replacement or private use)
+MIN_GLYPH_SANITY = 0.98
+
+# Pages with more vector paths than this are treated as charts / diagrams
+MAX_DRAWINGS = 200
+
+BULLETS = ("•", "●", "▪", "■", "◦", "‣", "–", "- ", "* ")
+
+
+# Share of characters that are printable and not replacement / private-use glyphs, which is what
+# a broken font encoding or a bad OCR layer produces
+def glyph_sanity(text):
+    chars = [ch for ch in text if not ch.isspace()]
+    if not chars:
+        return 1.0
+    bad = sum(1 for ch in chars if ch == "\ufffd" or not ch.isprintable() or 0xE000 <= ord(ch) <= 0xF8FF)
+    return 1 - bad / len(chars)
+
+
+# Score how far the embedded text layer of a page can be trusted on its own
+def score_text_layer(page, table_cache=None):
+    page_area = abs(page.rect)
+    text = page.get_text("text")
+    text_area = sum(abs(fitz.Rect(block[:4]) & page.rect) for block in page.get_text("blocks") if block[6] == 0 and block[4].strip())
+    image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    drawings = page.get_drawings()
+    # Thin rules and page-sized backgrounds do not hide content, filled shapes (bars, pies) do
+    drawing_area = sum(
+        abs(drawing["rect"] & page.rect) for drawing in drawings
+        if drawing.get("fill") is not None and abs(drawing["rect"]) < page_area * 0.9
+    )
+    content_area = text_area + image_area + drawing_area
+    tables = ruled_tables(page, table_cache)
+    return {
+        "characters": len(text.strip()),
+        "coverage": text_area / content_area if content_area else 1.0,
+        "glyph_sanity": glyph_sanity(text),
+        "image_ratio": image_area / page_area if page_area else 0.0,
+        "drawings": len(drawings),
+        "tables": None if tables is None else len(tables),
+        "columnar": looks_columnar(page, page.rect),
+    }
+
+
+# Decide whether a page is plain enough to emit its text layer as markdown without the vision model
+def is_simple_text_page(score):
+    return (
+        score["coverage"] >= MIN_TEXT_COVERAGE
+        and score["glyph_sanity"] >= MIN_GLYPH_SANITY
+        and score["drawings"] <= MAX_DRAWINGS
+        and score["tables"] == 0
+        and not score["columnar"]
+    )
+
+
+# Join the lines of a block into one paragraph, undoing end-of-line hyphenation
+def join_lines(lines):
+    text = ""
+    for line in lines:
+        if text.endswith("-") and line[:1].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    return re.sub(r"\s+", " ", text)
+
+
+# Render the text layer of a page as markdown; headings are inferred from the font size
+# relative to the body text, bullet glyphs become markdown list items
+def page_to_markdown(page):
+    blocks = [block for block in page.get_text("dict", sort=True)["blocks"] if block.get("type") == 0]
+    sizes = [span["size"] for block in blocks for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+    if not sizes:
+        return ""
+    body_size = statistics.median(sizes)
+
+    elements = []
+    for block in blocks:
+        lines, line_sizes, bold = [], [], True
+        for line in block["lines"]:
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            lines.append("".join(span["text"] for span in line["spans"]).strip())
+            line_sizes.append(max(span["size"] for span in spans))
+            bold = bold and all(span["flags"] & 16 for span in spans)
+        if not lines:
+            continue
+
+        ratio = max(line_sizes) / body_size
+        if ratio >= 1.6:
+            elements.append(f"# {join_lines(lines)}")
+        elif ratio >= 1.3:
+            elements.append(f"## {join_lines(lines)}")
+        elif ratio >= 1.1 or (bold and len(lines) == 1 and len(lines[0]) < 100):
+            elements.append(f"### {join_lines(lines)}")
+        elif lines[0].startswith(BULLETS):
+            items, current = [], []
+            for line in lines:
+                if line.startswith(BULLETS) and current:
+                    items.append(current)
+                    current = []
+                current.append(line)
+            items.append(current)
+            elements.append("\n".join(f"* {join_lines(item).lstrip(''.join(BULLETS)).strip()}" for item in items))
+        else:
+            elements.append(join_lines(lines))
+    return "\n\n".join(elements)
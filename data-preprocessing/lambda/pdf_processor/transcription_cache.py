@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Build a content-addressed cache key from the rendered page, the exact prompt text,
+# the model and the inference parameters. Any change to one of them is a new key.
+def transcription_cache_key(image, prompt, model_id, inference_config):
+    digest = hashlib.sha256()
+    for part in (image, prompt.encode("utf-8"), model_id.encode("utf-8"), json.dumps(inference_config, sort_keys=True).encode("utf-8")):
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+# Hit / miss counters shared by both cache backends
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+# Transcription cache in a local SQLite file (survives warm Lambda invocations in /tmp).
+# Least recently used entries are evicted once the stored text exceeds max_bytes.
+class SQLiteTranscriptionCache(CacheStats):
+    def __init__(self, path, max_bytes):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._db_lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._db_lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS transcriptions_last_access ON transcriptions (last_access)")
+
+    def get(self, key):
+        with self._db_lock, self._connection:
+            row = self._connection.execute("SELECT value FROM transcriptions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE transcriptions SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.record(row is not None)
+        return row[0] if row is not None else None
+
+    def put(self, key, value):
+        size = len(value.encode("utf-8"))
+        with self._db_lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO transcriptions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._connection.execute("SELECT key, size FROM transcriptions ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._connection.execute("DELETE FROM transcriptions WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info("Evicted %s transcription cache entries, %s bytes remaining", evicted, total)
+
+
+# Transcription cache stored as one object per key under an S3 prefix, shared by every
+# invocation. Eviction is left to a lifecycle expiration rule on the prefix.
+class S3TranscriptionCache(CacheStats):
+    def __init__(self, s3_client, bucket, prefix):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key[:2]}/{key}.txt"
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            self.record(False)
+            return None
+        self.record(True)
+        return response["Body"].read().decode("utf-8")
+
+    def put(self, key, value):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=value.encode("utf-8"))
+
+
+# Build the cache configured through the environment, or None when caching is disabled.
+#   TRANSCRIPTION_CACHE            none (default), sqlite or s3
+#   TRANSCRIPTION_CACHE_PATH       SQLite file, default /tmp/transcription-cache.sqlite3
+#   TRANSCRIPTION_CACHE_MAX_MB     SQLite size limit before eviction, default 200
+#   TRANSCRIPTION_CACHE_BUCKET     S3 bucket for the s3 backend
+#   TRANSCRIPTION_CACHE_PREFIX     S3 prefix for the s3 backend, default transcription-cache
+def transcription_cache_from_env(s3_client):
+    backend = os.getenv("TRANSCRIPTION_CACHE", "none").lower()
+    if backend == "sqlite":
+        path = os.getenv("TRANSCRIPTION_CACHE_PATH", "/tmp/transcription-cache.sqlite3")
+        max_bytes = int(os.getenv("TRANSCRIPTION_CACHE_MAX_MB", "200")) * 1024 * 1024
+        return SQLiteTranscriptionCache(path, max_bytes)
+    if backend == "s3":
+        return S3TranscriptionCache(s3_client, os.environ["TRANSCRIPTION_CACHE_BUCKET"], os.getenv("TRANSCRIPTION_CACHE_PREFIX", "transcription-cache"))
+    return None
@@ -41,6 +41,18 @@ export class RawDataEtlStack extends cdk.Stack {
       autoDeleteObjects: true,
     }); // New bucket that will hold the audio of the video
 
+    const transcriptionCacheBucket = new s3.Bucket(this, 'TranscriptionCacheBucket', {
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      lifecycleRules: [{ expiration: cdk.Duration.days(30) }], // Evict cached page transcriptions after 30 days
+    }); // Content-addressed cache of PDF page transcriptions, kept out of the knowledge base output bucket
+
+    const pdfProcessingStateBucket = new s3.Bucket(this, 'PdfProcessingStateBucket', {
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      lifecycleRules: [{ expiration: cdk.Duration.days(7) }],
+    }); // Per-document output parts and manifests written while a PDF is being processed
+
    // Adding test data for this stack
     const testDataBucket = new s3.Bucket(this, 'TestDataBucket', {
       removalPolicy: cdk.RemovalPolicy.DESTROY,
@@ -150,7 +162,7 @@ export class RawDataEtlStack extends cdk.Stack {
 
     // Create an SQS queue
     const queueToAnalyzeRemainingPDFPages = new sqs.Queue(this, 'QueueToAnalyzeRemaininingPDFPages', {
-      visibilityTimeout: cdk.Duration.minutes(15),  // Set visibility timeout to 15 minutes
+      visibilityTimeout: cdk.Duration.minutes(15),  // Not below the PDFProcessor timeout: page range leases expire before a message is redelivered
       retentionPeriod: cdk.Duration.days(4),        // Retention period remains 4 days
       deliveryDelay: cdk.Duration.minutes(1),       // Set delivery delay to 1 minute
     });
@@ -167,6 +179,10 @@ export class RawDataEtlStack extends cdk.Stack {
         'REGION': this.region,
         'OUTPUT_BUCKET': outputBucket.bucketName,
         'SQS_QUEUE_URL': queueToAnalyzeRemainingPDFPages.queueUrl, 
+        'PAGE_CONCURRENCY': '4', // Pages transcribed in parallel per invocation
+        'STATE_BUCKET': pdfProcessingStateBucket.bucketName,
+        'TRANSCRIPTION_CACHE': 's3',
+        'TRANSCRIPTION_CACHE_BUCKET': transcriptionCacheBucket.bucketName,
       },
     });
     
@@ -181,9 +197,13 @@ export class RawDataEtlStack extends cdk.Stack {
     // queueToAnalyzeRemainingPDFPages.grantSendMessages(pdfProcessorLambda);
     // queueToAnalyzeRemainingPDFPages.grantConsumeMessages(pdfProcessorLambda);
 
+    // Built from the repository root so the image can include the conversion module shared with
+    // data-pipeline; everything else is kept out of the build context
     const lambdaImageAsset = new ecr_assets.DockerImageAsset(this, 'LambdaImage', {
-      directory: path.join(__dirname, '../lambda/ppt_processor'),
-      file: 'lambda.dockerfile',
+      directory: path.join(__dirname, '../..'),
+      file: 'data-preprocessing/lambda/ppt_processor/lambda.dockerfile',
+      ignoreMode: cdk.IgnoreMode.DOCKER,
+      exclude: ['**', '!data-pipeline/*.py', '!data-preprocessing/lambda/ppt_processor/**'],
     });
 
     console.log(`Docker Image Repository: ${lambdaImageAsset.repository.repositoryUri}`);
@@ -204,6 +224,9 @@ export class RawDataEtlStack extends cdk.Stack {
 
     rawDataBucket.grantRead(pdfProcessorLambda); //This will convert the complex pdf to text format
     outputBucket.grantWrite(pdfProcessorLambda); //Output is pdf files
+    transcriptionCacheBucket.grantReadWrite(pdfProcessorLambda); //Cached page transcriptions
+    pdfProcessingStateBucket.grantReadWrite(pdfProcessorLambda); //Output parts and manifests
+    outputBucket.grantRead(pdfProcessorLambda); //UploadPartCopy and assembly of the final text file
     interimOutputPDFBucket.grantWrite(interimProcessorLambda); // Grant write permission for interimProcessorLambda for ppt/docx/excel files
     rawDataBucket.grantRead(interimProcessorLambda); //lambda that converst from ppt/doc/excel to pdf
     
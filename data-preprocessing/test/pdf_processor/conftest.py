@@ -0,0 +1,16 @@
+import os
+import sys
+
+# handler.py builds its AWS clients at import time; the tests never reach real AWS (S3 calls go to
+# moto, Bedrock to a stub)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("SQS_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/123456789012/pdf-pages")
+os.environ.setdefault("OUTPUT_BUCKET", "pdf-output")
+
+# moto has to be imported before the clients are created so that mock_aws intercepts them
+import moto  # noqa: E402,F401
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lambda", "pdf_processor"))
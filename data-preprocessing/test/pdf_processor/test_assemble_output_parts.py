@@ -0,0 +1,81 @@
+import json
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import handler
+from checkpoint import DocumentCheckpoint, LocalCheckpointStore
+
+MB = 1024 * 1024
+RUN_ID = "run-1"
+OUTPUT_KEY = "docs/report.pdf.txt"
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="pdf-state")
+        client.create_bucket(Bucket="pdf-output")
+        monkeypatch.setattr(handler, "s3_client", client)
+        monkeypatch.setattr(handler, "state_bucket", "pdf-state")
+        monkeypatch.setattr(handler, "output_bucket", "pdf-output")
+        handler.metrics.reset()
+        yield client
+
+
+# Store one part per size and record it in a local checkpoint; returns the checkpoint and the
+# expected output
+def write_parts(s3, tmp_path, sizes):
+    checkpoint = DocumentCheckpoint(LocalCheckpointStore(str(tmp_path / "checkpoints")), "checkpoint.json")
+    expected = b""
+    for page_num, size in enumerate(sizes):
+        body = os.urandom(size)
+        key = f"{handler.output_parts_prefix(OUTPUT_KEY, RUN_ID)}part-{page_num:06d}-{page_num + 1:06d}.txt"
+        s3.put_object(Bucket="pdf-state", Key=key, Body=body)
+        checkpoint.mark_page_done(page_num, key, size)
+        expected += body
+    return checkpoint, expected
+
+
+def output_body(s3):
+    return s3.get_object(Bucket="pdf-output", Key=OUTPUT_KEY)["Body"].read()
+
+
+def test_small_output_is_written_with_a_single_put(s3, tmp_path):
+    checkpoint, expected = write_parts(s3, tmp_path, [100, 2000, 50])
+
+    assert handler.assemble_output_parts(OUTPUT_KEY, RUN_ID, 3, checkpoint)
+
+    assert output_body(s3) == expected
+    manifest = json.loads(s3.get_object(Bucket="pdf-state", Key=f"{handler.output_parts_prefix(OUTPUT_KEY, RUN_ID)}manifest.json")["Body"].read())
+    assert [part["start"] for part in manifest["parts"]] == [0, 1, 2]
+
+
+def test_large_output_copies_big_parts_and_merges_small_neighbours(s3, tmp_path, monkeypatch):
+    # 6 MB is copied server side, 1 MB + 2 MB are below the 5 MB part minimum on their own and have
+    # to be merged with the following 6 MB part, the trailing 1 MB becomes the (small) last part
+    checkpoint, expected = write_parts(s3, tmp_path, [6 * MB, 1 * MB, 2 * MB, 6 * MB, 1 * MB])
+    calls = {"upload_part_copy": 0, "upload_part": 0}
+    for name in calls:
+        original = getattr(s3, name)
+
+        def counted(*args, _name=name, _original=original, **kwargs):
+            calls[_name] += 1
+            return _original(*args, **kwargs)
+        monkeypatch.setattr(s3, name, counted)
+
+    assert handler.assemble_output_parts(OUTPUT_KEY, RUN_ID, 5, checkpoint)
+
+    assert output_body(s3) == expected
+    assert calls == {"upload_part_copy": 1, "upload_part": 2}
+    assert s3.list_multipart_uploads(Bucket="pdf-output").get("Uploads", []) == []
+
+
+def test_output_is_not_assembled_while_pages_are_missing(s3, tmp_path):
+    checkpoint, _ = write_parts(s3, tmp_path, [100, 200])
+
+    assert not handler.assemble_output_parts(OUTPUT_KEY, RUN_ID, 3, checkpoint)
+    assert "Contents" not in s3.list_objects_v2(Bucket="pdf-output")
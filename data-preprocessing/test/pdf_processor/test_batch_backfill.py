@@ -0,0 +1,86 @@
+import json
+import os
+import random
+import sys
+
+import boto3
+import fitz
+import pytest
+from moto import mock_aws
+
+import batch_backfill
+
+
+def pdf_bytes(name, pages):
+    document = fitz.open()
+    for page_num in range(pages):
+        document.new_page().insert_text((72, 72), f"{name} page {page_num + 1}")
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def run_cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["batch_backfill.py", *args])
+    batch_backfill.main()
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        for bucket in ("source-pdfs", "batch-staging", "knowledge-base"):
+            client.create_bucket(Bucket=bucket)
+        yield client
+
+
+def test_prepare_then_assemble_returns_pages_in_order(monkeypatch, tmp_path, s3):
+    s3.put_object(Bucket="source-pdfs", Key="reports/a.pdf", Body=pdf_bytes("a", 3))
+    s3.put_object(Bucket="source-pdfs", Key="reports/b.pdf", Body=pdf_bytes("b", 12))
+    workdir = str(tmp_path / "backfill")
+
+    run_cli(monkeypatch, "prepare", "--workdir", workdir, "--no-fast-path", "s3://source-pdfs/reports/a.pdf", "s3://source-pdfs/reports/b.pdf")
+
+    with open(os.path.join(workdir, batch_backfill.MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    assert [entry["pages"] for entry in manifest["documents"]] == [3, 12]
+    record_ids = []
+    for name in manifest["input_files"]:
+        with open(os.path.join(workdir, name)) as f:
+            record_ids.extend(json.loads(line)["recordId"] for line in f)
+    assert len(record_ids) == 15
+
+    # Fake batch output: results come back shuffled and spread over several output files, the
+    # way a batch job writes them
+    random.Random(3).shuffle(record_ids)
+    for file_index, start in enumerate(range(0, len(record_ids), 4)):
+        lines = [
+            json.dumps({"recordId": rid, "modelOutput": {"content": [{"type": "text", "text": f"text of {rid}"}]}})
+            for rid in record_ids[start:start + 4]
+        ]
+        s3.put_object(Bucket="batch-staging", Key=f"out/job-1/records-{file_index:04d}.jsonl.out", Body="\n".join(lines).encode("utf-8"))
+
+    run_cli(monkeypatch, "assemble", "--workdir", workdir, "--results", "s3://batch-staging/out/job-1/", "--output-bucket", "knowledge-base")
+
+    for document_index, (key, pages) in enumerate((("reports/a.pdf.txt", 3), ("reports/b.pdf.txt", 12))):
+        text = s3.get_object(Bucket="knowledge-base", Key=key)["Body"].read().decode("utf-8")
+        expected = "".join(
+            f"Page {page_num + 1}\ntext of {batch_backfill.record_id(document_index, page_num)}\n\n" for page_num in range(pages)
+        )
+        assert text == expected
+
+
+def test_assemble_skips_documents_with_failed_records(monkeypatch, tmp_path, s3):
+    s3.put_object(Bucket="source-pdfs", Key="a.pdf", Body=pdf_bytes("a", 2))
+    workdir = str(tmp_path / "backfill")
+    run_cli(monkeypatch, "prepare", "--workdir", workdir, "--no-fast-path", "s3://source-pdfs/a.pdf")
+
+    lines = [
+        json.dumps({"recordId": batch_backfill.record_id(0, 0), "modelOutput": {"content": [{"type": "text", "text": "first"}]}}),
+        json.dumps({"recordId": batch_backfill.record_id(0, 1), "error": {"errorCode": 500, "errorMessage": "failed"}}),
+    ]
+    s3.put_object(Bucket="batch-staging", Key="out/job-2/records-0000.jsonl.out", Body="\n".join(lines).encode("utf-8"))
+
+    run_cli(monkeypatch, "assemble", "--workdir", workdir, "--results", "s3://batch-staging/out/job-2/", "--output-bucket", "knowledge-base")
+
+    assert "Contents" not in s3.list_objects_v2(Bucket="knowledge-base")
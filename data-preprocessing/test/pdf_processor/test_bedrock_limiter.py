@@ -0,0 +1,174 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import handler
+from bedrock_limiter import BedrockRateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_starts_full_and_refills_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=2, capacity=4, clock=clock)
+    assert bucket.reserve(4) == 0.0
+    assert bucket.tokens == 0
+
+    clock.now += 1
+    assert bucket.reserve(2) == 0.0
+
+    clock.now += 100
+    bucket.adjust(0)
+    assert bucket.tokens == 4
+
+
+def test_token_bucket_reservation_over_balance_returns_wait():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=2, capacity=2, clock=clock)
+    assert bucket.reserve(2) == 0.0
+    # The balance goes negative and each caller waits for its own share
+    assert bucket.reserve(1) == pytest.approx(0.5)
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_token_bucket_adjust_returns_unused_tokens():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=1, capacity=10, clock=clock)
+    bucket.reserve(8)
+    bucket.adjust(5)
+    assert bucket.tokens == 7
+    bucket.adjust(50)
+    assert bucket.tokens == 10
+
+
+def test_limiter_acquire_sleeps_once_the_request_rate_is_used_up():
+    clock = FakeClock()
+    limiter = BedrockRateLimiter(requests_per_second=2, tokens_per_minute=600000, clock=clock, sleep=clock.sleep)
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_limiter_acquire_waits_for_the_token_budget():
+    clock = FakeClock()
+    limiter = BedrockRateLimiter(requests_per_second=100, tokens_per_minute=6000, initial_token_estimate=6000, clock=clock, sleep=clock.sleep)
+    assert limiter.acquire() == 6000
+    assert clock.sleeps == []
+    limiter.acquire()
+    # 6000 tokens at 100 tokens per second
+    assert clock.sleeps == [pytest.approx(60.0)]
+
+
+def test_limiter_record_usage_settles_the_reservation_and_updates_the_estimate():
+    clock = FakeClock()
+    limiter = BedrockRateLimiter(requests_per_second=10, tokens_per_minute=60000, initial_token_estimate=2000, clock=clock, sleep=clock.sleep)
+    estimate = limiter.acquire()
+    limiter.record_usage(estimate, 1000)
+    assert limiter.tokens.tokens == 59000
+    assert limiter.token_estimate == 1800
+
+
+def test_limiter_throttle_halves_the_rate_and_success_wins_it_back(monkeypatch):
+    monkeypatch.setattr("bedrock_limiter.random.uniform", lambda low, high: high)
+    limiter = BedrockRateLimiter(requests_per_second=4, tokens_per_minute=60000, min_scale=0.1, max_backoff=30)
+
+    assert limiter.on_throttle(0, 10) == 10
+    assert limiter.requests.rate_per_second == 2
+    assert limiter.tokens.rate_per_second == 500
+    assert limiter.on_throttle(1, 10) == 20
+    assert limiter.on_throttle(2, 10) == 30  # capped at max_backoff
+    limiter.on_throttle(3, 10)
+    assert limiter.scale == 0.1  # never below min_scale
+
+    limiter.on_success()
+    assert limiter.scale == pytest.approx(0.15)
+    assert limiter.requests.rate_per_second == pytest.approx(0.6)
+    for _ in range(30):
+        limiter.on_success()
+    assert limiter.scale == 1.0
+
+
+def converse_response(text="transcribed"):
+    return {
+        "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+        "stopReason": "end_turn",
+        "usage": {"inputTokens": 100, "outputTokens": 20, "totalTokens": 120},
+    }
+
+
+class ThrottlingBedrock:
+    def __init__(self, throttles):
+        self.throttles = throttles
+        self.calls = 0
+
+    def converse(self, **request):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "Converse")
+        return converse_response()
+
+
+@pytest.fixture
+def throttled_handler(monkeypatch):
+    clock = FakeClock()
+    limiter = BedrockRateLimiter(requests_per_second=100, tokens_per_minute=600000, clock=clock, sleep=clock.sleep)
+    monkeypatch.setattr(handler, "bedrock_limiter", limiter)
+    monkeypatch.setattr(handler.time, "sleep", clock.sleep)
+    monkeypatch.setattr("bedrock_limiter.random.uniform", lambda low, high: high)
+    handler.metrics.reset()
+    return limiter, clock
+
+
+def test_invoke_with_delay_backs_off_on_throttling(monkeypatch, throttled_handler):
+    limiter, clock = throttled_handler
+    bedrock = ThrottlingBedrock(throttles=2)
+    monkeypatch.setattr(handler, "bedrock_runtime", bedrock)
+
+    response = handler.invoke_with_delay("model", [{"role": "user", "content": [{"text": "hi"}]}], delay=1)
+
+    assert response["output"]["message"]["content"][0]["text"] == "transcribed"
+    assert bedrock.calls == 3
+    # Full-jitter exponential backoff (upper bound here): 1, then 2 seconds
+    assert clock.sleeps == [1, 2]
+    # Two throttles halved the rate twice, the success won 5% back
+    assert limiter.scale == pytest.approx(0.3)
+    assert handler.metrics.events[-1]["retries"] == 2
+
+
+def test_invoke_with_delay_gives_up_after_max_retries(monkeypatch, throttled_handler):
+    _, clock = throttled_handler
+    bedrock = ThrottlingBedrock(throttles=10)
+    monkeypatch.setattr(handler, "bedrock_runtime", bedrock)
+
+    with pytest.raises(Exception, match="Max retries exceeded"):
+        handler.invoke_with_delay("model", [{"role": "user", "content": [{"text": "hi"}]}], delay=1, max_retries=3)
+    assert bedrock.calls == 4
+    assert len(clock.sleeps) == 3
+    assert handler.metrics.events[-1]["error"] == "Exception"
+
+
+def test_invoke_with_delay_does_not_retry_other_errors(monkeypatch, throttled_handler):
+    class InvalidBedrock:
+        calls = 0
+
+        def converse(self, **request):
+            self.calls += 1
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "Converse")
+
+    bedrock = InvalidBedrock()
+    monkeypatch.setattr(handler, "bedrock_runtime", bedrock)
+    with pytest.raises(Exception, match="ModelInvocationException"):
+        handler.invoke_with_delay("model", [{"role": "user", "content": [{"text": "hi"}]}])
+    assert bedrock.calls == 1